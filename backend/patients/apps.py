@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class PatientsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'patients'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from vesynta_backend.database import configure_sqlite_connection
+
+        connection_created.connect(configure_sqlite_connection, dispatch_uid='sqlite_performance_profile')
+
+        from django.core.signals import request_started
+        from .jobs import start_workers_for_request
+
+        request_started.connect(start_workers_for_request, dispatch_uid='patients_job_workers')
@@ -0,0 +1,245 @@
+"""
+Benchmarks for the patient API hot paths.
+
+Each endpoint is driven through the Django test client (so middleware,
+routing and rendering are included) against a seeded SQLite database and a
+local StubPatientAPI. Latency is measured without instrumentation; query
+count and peak Python memory come from a separate instrumented pass.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import Client
+
+from .models import Patient
+from .query_budget import log_queries
+
+SEED_BATCH_SIZE = 5000
+
+# Every Nth seeded patient mirrors a stub external patient (source 'both')
+MIRRORED_EVERY = 10
+
+
+def seed_patients(target_count, batch_size=SEED_BATCH_SIZE):
+    """Top the patients table up to target_count rows with bulk_create"""
+    existing = Patient.objects.count()
+    base_dob = datetime(1950, 1, 1, tzinfo=timezone.utc)
+    for start in range(existing, target_count, batch_size):
+        batch = []
+        for index in range(start, min(start + batch_size, target_count)):
+            patient = Patient(
+                first_name='Seed',
+                last_name=f"Patient{index}",
+                dob=base_dob + timedelta(days=index % 20000),
+                sex=('male', 'female', 'other')[index % 3],
+                ethnic_background='unknown',
+                third_party_id=f"stub_{index}" if index % MIRRORED_EVERY == 0 else None,
+            )
+            patient.refresh_blocking_key()
+            batch.append(patient)
+        Patient.objects.bulk_create(batch)
+    return target_count
+
+
+def _patient_payload():
+    return {
+        'first_name': 'Bench',
+        'last_name': 'Patient',
+        'dob': '1980-05-15T00:00:00.000Z',
+        'sex': 'female',
+        'ethnic_background': 'unknown',
+    }
+
+
+def endpoint_cases():
+    """(name, method, path factory, body factory) for every benchmarked endpoint"""
+    local_id = str(Patient.objects.order_by('created_at').values_list('id', flat=True).first())
+
+    def copy_body():
+        return {**_patient_payload(), 'third_party_id': f"bench_{uuid.uuid4().hex}"}
+
+    def bulk_copy_body():
+        return [copy_body() for _ in range(100)]
+
+    def process_body():
+        return {'weight': {'value': 70, 'unit': 'kg'}, 'height': {'value': 175, 'unit': 'cm'}}
+
+    return [
+        ('list', 'get', lambda: '/api/patients?page=1', None),
+        ('list_sparse', 'get', lambda: '/api/patients?page=1&fields=id,first_name,last_name', None),
+        ('stats', 'get', lambda: '/api/patients/stats', None),
+        ('detail_local', 'get', lambda: f"/api/patients/{local_id}", None),
+        ('detail_mirrored', 'get', lambda: '/api/patients/stub_0', None),
+        ('detail_external', 'get', lambda: '/api/patients/stub_1', None),
+        ('create', 'post', lambda: '/api/patients', _patient_payload),
+        ('copy', 'post', lambda: '/api/patients/copy', copy_body),
+        ('copy_bulk_100', 'post', lambda: '/api/patients/copy', bulk_copy_body),
+        ('process', 'post', lambda: f"/api/patients/{local_id}/process", process_body),
+    ]
+
+
+def _request(client, method, path, body_factory, **headers):
+    # process results are cached; clear so every run pays for the full path
+    cache.clear()
+    if method == 'get':
+        return client.get(path, **headers)
+    return client.post(path, body_factory(), content_type='application/json', **headers)
+
+
+def measure_endpoint(client, method, path_factory, body_factory, iterations):
+    """Latency percentiles, query count, peak memory and payload size for one endpoint"""
+    if iterations < 1:
+        raise ValueError("iterations must be at least 1")
+    _request(client, method, path_factory(), body_factory)  # warm-up
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        _request(client, method, path_factory(), body_factory)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    try:
+        # Counted with execute_wrapper: the test client's request_started
+        # signal resets connection.queries mid-request when DEBUG is on
+        with log_queries('benchmark', log_slow=False) as queries:
+            response = _request(client, method, path_factory(), body_factory)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    
+    compressed = _request(client, method, path_factory(), body_factory, HTTP_ACCEPT_ENCODING='br, gzip')
+
+    latencies.sort()
+    return {
+        'status': response.status_code,
+        'p50_ms': round(statistics.median(latencies), 3),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+        'max_ms': round(latencies[-1], 3),
+        'queries': queries.count,
+        'peak_memory_kb': round(peak_memory / 1024, 1),
+        'response_bytes': len(response.content),
+        'compressed_bytes': len(compressed.content),
+    }
+
+
+def run_benchmarks(sizes, iterations=5, endpoints=None, log=None):
+    """Seed each dataset size in turn and measure every endpoint against it"""
+    client = Client()
+    results = {}
+    for size in sorted(sizes):
+        start = time.perf_counter()
+        seed_patients(size)
+        if log:
+            log(f"Seeded {size} patients in {time.perf_counter() - start:.1f}s")
+
+        results[str(size)] = {}
+        for name, method, path_factory, body_factory in endpoint_cases():
+            if endpoints and name not in endpoints:
+                continue
+            results[str(size)][name] = measure_endpoint(client, method, path_factory, body_factory, iterations)
+            if log:
+                result = results[str(size)][name]
+                log(f"  {name:<16} p50={result['p50_ms']:>9.2f}ms p95={result['p95_ms']:>9.2f}ms "
+                    f"queries={result['queries']:<4} peak={result['peak_memory_kb']:>10.1f}KB "
+                    f"bytes={result['response_bytes']:>9} compressed={result['compressed_bytes']:>8}")
+    return results
+
+
+# Runs in a fresh interpreter: time importing the WSGI app, then the first
+# request, optionally after waiting for the warm start to finish
+STARTUP_SCRIPT = """
+import json, time
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+
+start = time.perf_counter()
+from vesynta_backend.wsgi import application
+boot = time.perf_counter() - start
+
+from patients.warmup import timings, wait_for_warm_start
+wait_for_warm_start()
+
+environ = {'PATH_INFO': '/api/patients', 'QUERY_STRING': 'page=1', 'HTTP_HOST': '127.0.0.1',
+           'wsgi.input': BytesIO()}
+setup_testing_defaults(environ)
+start = time.perf_counter()
+body = b''.join(application(environ, lambda status, headers: None))
+first_request = time.perf_counter() - start
+print(json.dumps({'boot': boot, 'warm_up': timings.get('total', 0.0), 'first_request': first_request}))
+"""
+
+
+def measure_startup(db_path, external_api_url, runs=3):
+    """
+    Cold-start cost of a worker, with and without the warm start
+    Each run is a fresh interpreter, so import and connection costs are real.
+    """
+    samples = {'boot': [], 'warm_up': [], 'first_request_cold': [], 'first_request_warm': []}
+    for warm in (False, True):
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'vesynta_backend.settings'),
+            'SQLITE_PATH': str(db_path),
+            'EXTERNAL_API_URL': external_api_url,
+            'WARM_START': str(warm),
+        }
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, '-c', STARTUP_SCRIPT], env=env, cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            samples['first_request_warm' if warm else 'first_request_cold'].append(result['first_request'])
+            if warm:
+                samples['warm_up'].append(result['warm_up'])
+            else:
+                samples['boot'].append(result['boot'])
+    return {
+        name: {'p50_ms': round(statistics.median(values) * 1000, 3), 'max_ms': round(max(values) * 1000, 3)}
+        for name, values in samples.items()
+    }
+
+
+def find_regressions(results, baseline, threshold=0.25, min_delta_ms=2.0, min_delta_kb=64.0):
+    """
+    Compare results against a baseline and describe every regression
+    Latency and peak memory regress when they grow by more than threshold
+    and by at least min_delta_ms / min_delta_kb, to ignore noise on small
+    values; any increase in query count or change of status code (a fast
+    500 is not a speed-up) is a regression.
+    """
+    regressions = []
+    for size, endpoints in results.items():
+        for name, current in endpoints.items():
+            previous = baseline.get(size, {}).get(name)
+            if not previous:
+                continue
+            if 'status' in previous and current.get('status') != previous['status']:
+                regressions.append(
+                    f"{name} @ {size}: status {previous['status']} -> {current.get('status')}"
+                )
+            if (current['p50_ms'] > previous['p50_ms'] * (1 + threshold)
+                    and current['p50_ms'] - previous['p50_ms'] >= min_delta_ms):
+                regressions.append(
+                    f"{name} @ {size}: p50 {previous['p50_ms']}ms -> {current['p50_ms']}ms"
+                )
+            if current.get('queries', 0) > previous.get('queries', 0):
+                regressions.append(
+                    f"{name} @ {size}: queries {previous['queries']} -> {current['queries']}"
+                )
+            if (current.get('peak_memory_kb', 0) > previous.get('peak_memory_kb', 0) * (1 + threshold)
+                    and current.get('peak_memory_kb', 0) - previous.get('peak_memory_kb', 0) >= min_delta_kb):
+                regressions.append(
+                    f"{name} @ {size}: peak memory {previous['peak_memory_kb']}KB -> {current['peak_memory_kb']}KB"
+                )
+    return regressions
@@ -0,0 +1,119 @@
+"""
+In-process pub/sub for patient change events, streamed to clients as SSE.
+
+Services publish from request threads; each subscriber is an SSE response
+running on the ASGI event loop, woken with call_soon_threadsafe. Every
+subscriber has a bounded buffer: when a slow client falls more than
+EVENT_STREAM_BUFFER events behind, the backlog is replaced by a single
+`resync` event telling it to refetch; so does a reconnecting client whose
+Last-Event-ID shows it missed events while away. Events only reach clients connected
+to the same process, so serve the stream from one ASGI worker (or put a
+shared broker in front) when running several.
+"""
+import asyncio
+import itertools
+import json
+import threading
+from collections import deque
+
+from django.conf import settings
+
+from .metrics import EVENTS_DROPPED
+
+RESYNC = 'resync'
+
+
+class Subscription:
+    def __init__(self, broker, loop, buffer_size):
+        self._broker = broker
+        self._loop = loop
+        self._buffer = deque()
+        self._buffer_size = buffer_size
+        self._ready = asyncio.Event()
+        self._overflowed = False
+        self._lock = threading.Lock()
+
+    def _push(self, event):
+        """Called from any thread"""
+        with self._lock:
+            if self._overflowed:
+                return
+            if len(self._buffer) >= self._buffer_size:
+                EVENTS_DROPPED.inc(len(self._buffer) + 1)
+                self._buffer.clear()
+                self._overflowed = True
+            else:
+                self._buffer.append(event)
+        self._loop.call_soon_threadsafe(self._ready.set)
+
+    async def get(self, timeout=None):
+        """Wait for the next batch of events; an empty list means the timeout passed"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        with self._lock:
+            self._ready.clear()
+            if self._overflowed:
+                self._overflowed = False
+                return [{'id': None, 'type': RESYNC, 'data': {}}]
+            events = list(self._buffer)
+            self._buffer.clear()
+        return events
+
+    def close(self):
+        self._broker.unsubscribe(self)
+
+
+class EventBroker:
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # ID of the newest published event (0 before the first)
+        self.last_id = 0
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def subscribe(self, buffer_size=None):
+        """Subscribe the running event loop; returns None when at EVENT_STREAM_MAX_CLIENTS"""
+        subscription = Subscription(
+            self, asyncio.get_running_loop(), buffer_size or settings.EVENT_STREAM_BUFFER
+        )
+        with self._lock:
+            if len(self._subscribers) >= settings.EVENT_STREAM_MAX_CLIENTS:
+                return None
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event_type, data):
+        """Send an event to every subscriber; safe to call from any thread"""
+        event = {'id': next(self._ids), 'type': event_type, 'data': data}
+        self.last_id = event['id']
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription._push(event)
+            except RuntimeError:
+                # The subscriber's event loop has closed
+                self.unsubscribe(subscription)
+
+
+def format_sse(event):
+    """Encode an event in the text/event-stream wire format"""
+    lines = []
+    if event.get('id') is not None:
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event['data'], default=str)}")
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+broker = EventBroker()
@@ -0,0 +1,215 @@
+"""
+Background jobs for POST /patients/{id}/process?async=1.
+
+Jobs live in the process_jobs table, so no broker is needed and queued
+work survives a restart. Each server process runs JOB_WORKERS threads
+that claim jobs with a conditional UPDATE (safe across processes), wait
+while the shared process rate budget is spent, and retry upstream 429s
+and errors with exponential backoff up to JOB_MAX_ATTEMPTS. Clients poll
+GET /jobs/{id}; successful results also go out as process.completed
+events. The rate budget lives in the default cache, so it is only shared
+between processes when that cache is.
+
+The pool starts on the first request a process handles (or the first
+enqueue), so only serving processes run one: never a gunicorn --preload
+master, which would otherwise fork while its workers hold locks or
+upstream sockets. A forked child forgets any pool it inherited and
+starts its own the same way. With JOB_WORKERS=0 nothing would ever run a
+job, so async processing answers 503.
+"""
+import logging
+import os
+import random
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ProcessJob
+from .services import RATE_LIMIT_ERROR, api_client
+
+logger = logging.getLogger('patients.jobs')
+
+# Candidates fetched per claim attempt, in case other workers win the first ones
+CLAIM_BATCH = 5
+
+_pool = None
+_lock = threading.Lock()
+
+
+def enqueue_process_job(patient_id, process_data):
+    """Queue a process call; returns (job data, status code) like the API client"""
+    if settings.JOB_WORKERS <= 0:
+        return {"error": "Background processing is disabled on this server; retry without async"}, 503
+    try:
+        job = ProcessJob.objects.create(patient_id=patient_id, payload=process_data)
+    except Exception as e:
+        return {"error": f"Failed to queue process job: {str(e)}"}, 500
+    pool = start_workers()
+    if pool is not None:
+        pool.wake()
+    return job.to_dict(), 202
+
+
+def get_job(job_id):
+    """Look up a process job by ID"""
+    try:
+        return ProcessJob.objects.get(id=job_id).to_dict(), 200
+    except (ProcessJob.DoesNotExist, ValidationError):
+        # ValidationError: the ID isn't a UUID, so no job can have it
+        return {"error": "Job not found"}, 404
+    except Exception as e:
+        return {"error": f"Failed to get job: {str(e)}"}, 500
+
+
+def requeue_stale_jobs():
+    """Put back jobs left running by a worker that died; returns how many"""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_STALE_AFTER)
+    return ProcessJob.objects.filter(status=ProcessJob.RUNNING, updated_at__lt=cutoff).update(
+        status=ProcessJob.QUEUED, run_after=timezone.now(), updated_at=timezone.now()
+    )
+
+
+def claim_next_job():
+    """Mark the next due job as running and return it (None when nothing is due)"""
+    now = timezone.now()
+    candidates = ProcessJob.objects.filter(
+        status=ProcessJob.QUEUED, run_after__lte=now
+    ).order_by('run_after', 'created_at').values_list('id', flat=True)[:CLAIM_BATCH]
+    for job_id in candidates:
+        claimed = ProcessJob.objects.filter(id=job_id, status=ProcessJob.QUEUED).update(
+            status=ProcessJob.RUNNING, attempts=F('attempts') + 1, updated_at=now
+        )
+        if claimed:
+            return ProcessJob.objects.get(id=job_id)
+    return None
+
+
+def _retry_delay(attempts):
+    delay = min(settings.JOB_RETRY_BASE_DELAY * 2 ** (attempts - 1), settings.JOB_RETRY_MAX_DELAY)
+    # Jitter so jobs rejected together don't all come back together
+    return delay * random.uniform(0.5, 1.0)
+
+
+def run_job(job):
+    """Run one claimed job and record its outcome"""
+    try:
+        result, status_code = api_client.process_patient(job.patient_id, job.payload)
+    except Exception as e:
+        logger.exception("Process job %s raised", job.id)
+        result, status_code = {"error": f"Failed to process patient: {str(e)}"}, 500
+    
+    if status_code == 429 and result.get("error") == RATE_LIMIT_ERROR:
+        # Another worker spent the local budget first; the call was never
+        # made, so wait for a slot without using up an attempt
+        job.status = ProcessJob.QUEUED
+        job.attempts -= 1
+        job.run_after = timezone.now() + timedelta(seconds=api_client.rate_limit_delay())
+        job.save(update_fields=['status', 'attempts', 'run_after', 'updated_at'])
+        return job
+    
+    job.result = result
+    job.status_code = status_code
+    if status_code == 200 and "error" not in result:
+        job.status = ProcessJob.SUCCEEDED
+        job.finished_at = timezone.now()
+    elif (status_code == 429 or status_code >= 500) and job.attempts < settings.JOB_MAX_ATTEMPTS:
+        job.status = ProcessJob.QUEUED
+        job.run_after = timezone.now() + timedelta(seconds=_retry_delay(job.attempts))
+    else:
+        job.status = ProcessJob.FAILED
+        job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'status_code', 'run_after', 'finished_at', 'updated_at'])
+    return job
+
+
+def run_next_job():
+    """Claim and run the next due job if the rate budget allows; True if one ran"""
+    if api_client.rate_limit_delay() > 0:
+        return False
+    job = claim_next_job()
+    if job is None:
+        return False
+    run_job(job)
+    return True
+
+
+class JobWorkerPool:
+    def __init__(self, size):
+        self.size = size
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.size):
+            # The first worker requeues stale jobs, keeping that query off
+            # the request that may have started the pool
+            thread = threading.Thread(target=self._work, args=(index == 0,),
+                                      name=f'patients-job-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wake(self):
+        """Tell idle workers a job was queued"""
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _requeue_stale_jobs(self):
+        try:
+            requeued = requeue_stale_jobs()
+            if requeued:
+                logger.warning("Requeued %s process jobs left running by a stopped worker", requeued)
+        except Exception:
+            logger.exception("Requeueing stale process jobs failed")
+
+    def _work(self, requeue_stale=False):
+        if requeue_stale:
+            self._requeue_stale_jobs()
+        while not self._stop.is_set():
+            self._wake.clear()
+            close_old_connections()
+            try:
+                ran = run_next_job()
+            except Exception:
+                logger.exception("Process job worker failed to claim a job")
+                ran = False
+            if not ran:
+                self._wake.wait(settings.JOB_POLL_INTERVAL)
+
+
+def start_workers():
+    """Start this process's worker pool once; returns it (None when JOB_WORKERS is 0)"""
+    global _pool
+    if _pool is not None or settings.JOB_WORKERS <= 0:
+        return _pool
+    with _lock:
+        if _pool is None:
+            _pool = JobWorkerPool(settings.JOB_WORKERS)
+            _pool.start()
+    return _pool
+
+
+def start_workers_for_request(sender, **kwargs):
+    """request_started receiver: serving processes start their pool on their first request"""
+    start_workers()
+
+
+def _reset_after_fork():
+    """Threads don't survive fork; the child starts its own pool on its first request"""
+    global _pool, _lock
+    _pool = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
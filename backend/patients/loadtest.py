@@ -0,0 +1,257 @@
+"""
+Concurrent load generator for a running patients API.
+
+Worker threads pick operations from a weighted mix and record each
+response in a per-endpoint LatencyHistogram. Run the server against a
+StubPatientAPI (manage.py stub_api) so upstream latency, errors and 429s
+are under your control.
+"""
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+import requests
+
+DEFAULT_MIX = 'list=40,detail=30,create=5,copy=10,process=10,delete=5'
+
+OPERATIONS = ('list', 'detail', 'create', 'copy', 'process', 'delete')
+
+
+def parse_mix(mix):
+    """Parse "list=40,detail=30" into {'list': 40.0, 'detail': 30.0}"""
+    weights = {}
+    for part in mix.split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}'; expected one of {', '.join(OPERATIONS)}")
+        try:
+            weights[name] = float(weight)
+        except ValueError:
+            raise ValueError(f"Invalid weight for '{name}': {weight!r}")
+        if not weights[name] >= 0:
+            raise ValueError(f"Weight for '{name}' must not be negative: {weight!r}")
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError("The mix needs at least one operation with a positive weight")
+    return weights
+
+
+class LatencyHistogram:
+    """
+    HDR-style latency histogram: values are bucketed with a fixed number of
+    significant digits, so relative error stays constant from microseconds
+    to minutes while memory stays bounded.
+    """
+
+    def __init__(self, significant_digits=3):
+        self.significant_digits = significant_digits
+        self.counts = Counter()
+        self.total = 0
+        self.max = 0.0
+        self.min = math.inf
+        self._lock = threading.Lock()
+
+    def _bucket(self, value_us):
+        if value_us < 1:
+            return 0
+        magnitude = 10 ** max(int(math.log10(value_us)) + 1 - self.significant_digits, 0)
+        return math.ceil(value_us / magnitude) * magnitude
+
+    def record(self, seconds):
+        value_us = seconds * 1_000_000
+        with self._lock:
+            self.counts[self._bucket(value_us)] += 1
+            self.total += 1
+            self.max = max(self.max, seconds)
+            self.min = min(self.min, seconds)
+
+    def merge(self, other):
+        with self._lock:
+            self.counts.update(other.counts)
+            self.total += other.total
+            self.max = max(self.max, other.max)
+            self.min = min(self.min, other.min)
+
+    def _walk(self, percent):
+        """(latency ms, samples at or below it) for the given percentile"""
+        if not self.total:
+            return 0.0, 0
+        rank = max(math.ceil(self.total * percent / 100), 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(bucket / 1000, self.max * 1000), seen
+        return self.max * 1000, self.total
+
+    def percentile(self, percent):
+        """Latency in milliseconds at the given percentile"""
+        return self._walk(percent)[0]
+
+    def distribution(self, percentiles=(50, 75, 90, 95, 99, 99.9, 100)):
+        """(percentile, latency ms, count at or below) rows, like HdrHistogram output"""
+        return [(percent, *self._walk(percent)) for percent in percentiles]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.statuses = Counter()
+        self.errors = 0
+
+    def summary(self, elapsed):
+        total = self.histogram.total
+        return {
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 2) if elapsed else 0.0,
+            'error_rate': round(self.errors / total, 4) if total else 0.0,
+            'rate_limited_rate': round(self.statuses.get(429, 0) / total, 4) if total else 0.0,
+            'statuses': {str(code): count for code, count in sorted(self.statuses.items(), key=lambda s: str(s[0]))},
+            'p50_ms': round(self.histogram.percentile(50), 3),
+            'p95_ms': round(self.histogram.percentile(95), 3),
+            'p99_ms': round(self.histogram.percentile(99), 3),
+            'max_ms': round(self.histogram.max * 1000, 3),
+        }
+
+
+class LoadTest:
+    def __init__(self, base_url, mix, concurrency=8, duration=30.0, max_requests=None, timeout=30.0):
+        self.base_url = base_url.rstrip('/')
+        self.weights = parse_mix(mix) if isinstance(mix, str) else mix
+        self.concurrency = concurrency
+        self.duration = duration
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.stats = {name: EndpointStats() for name in self.weights}
+        self._lock = threading.Lock()
+        self._issued = 0
+        self._patient_ids = []
+        # Patients created by this run; delete only ever removes these
+        self._deletable = deque()
+
+    def _next_operation(self):
+        with self._lock:
+            if self.max_requests is not None and self._issued >= self.max_requests:
+                return None
+            self._issued += 1
+        names = list(self.weights)
+        return random.choices(names, weights=[self.weights[n] for n in names])[0]
+
+    def _patient_payload(self):
+        return {
+            'first_name': 'Load',
+            'last_name': 'Test',
+            'dob': '1985-03-20T00:00:00.000Z',
+            'sex': random.choice(['male', 'female', 'other']),
+            'ethnic_background': 'unknown',
+        }
+
+    def _send(self, session, operation):
+        """Issue one request for an operation; returns the response"""
+        url = self.base_url
+        if operation == 'list':
+            return session.get(f"{url}/patients", params={'page': random.randint(1, 3)}, timeout=self.timeout)
+        if operation == 'detail':
+            return session.get(f"{url}/patients/{random.choice(self._patient_ids)}", timeout=self.timeout)
+        if operation == 'create':
+            return session.post(f"{url}/patients", json=self._patient_payload(), timeout=self.timeout)
+        if operation == 'copy':
+            body = {**self._patient_payload(), 'third_party_id': f"load_{uuid.uuid4().hex}"}
+            return session.post(f"{url}/patients/copy", json=body, timeout=self.timeout)
+        if operation == 'process':
+            # Vary the payload so most calls miss the process cache
+            body = {
+                'weight': {'value': round(random.uniform(40, 120), 1), 'unit': 'kg'},
+                'height': {'value': round(random.uniform(150, 200), 1), 'unit': 'cm'},
+            }
+            return session.post(f"{url}/patients/{random.choice(self._patient_ids)}/process",
+                                json=body, timeout=self.timeout)
+        if operation == 'delete':
+            with self._lock:
+                patient_id = self._deletable.popleft() if self._deletable else None
+            if patient_id is None:
+                # Nothing of ours to delete yet; exercise the 404 path instead
+                patient_id = str(uuid.uuid4())
+            return session.delete(f"{url}/patients/{patient_id}/delete", timeout=self.timeout)
+        raise ValueError(operation)
+
+    def _remember_created(self, operation, response):
+        if operation not in ('create', 'copy') or response.status_code != 201:
+            return
+        data = response.json()
+        patient_id = data.get('local_id') or data.get('id')
+        if patient_id:
+            with self._lock:
+                self._deletable.append(patient_id)
+
+    def _worker(self, deadline):
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            operation = self._next_operation()
+            if operation is None:
+                break
+            stats = self.stats[operation]
+            start = time.perf_counter()
+            try:
+                response = self._send(session, operation)
+            except requests.RequestException:
+                stats.histogram.record(time.perf_counter() - start)
+                with self._lock:
+                    stats.errors += 1
+                    stats.statuses['connection_error'] += 1
+                continue
+            stats.histogram.record(time.perf_counter() - start)
+            with self._lock:
+                stats.statuses[response.status_code] += 1
+                if response.status_code >= 500:
+                    stats.errors += 1
+            self._remember_created(operation, response)
+        session.close()
+
+    def prepare(self):
+        """Collect patient IDs to target for detail and process traffic"""
+        response = requests.get(f"{self.base_url}/patients", params={'page': 1}, timeout=self.timeout)
+        response.raise_for_status()
+        self._patient_ids = [p['id'] for p in response.json().get('patients', []) if p.get('id')]
+        if not self._patient_ids:
+            response = requests.post(f"{self.base_url}/patients/copy", timeout=self.timeout,
+                                     json={**self._patient_payload(), 'third_party_id': f"load_{uuid.uuid4().hex}"})
+            response.raise_for_status()
+            self._patient_ids = [response.json()['id']]
+
+    def run(self):
+        self.prepare()
+        deadline = time.monotonic() + self.duration
+        threads = [threading.Thread(target=self._worker, args=(deadline,)) for _ in range(self.concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(time.perf_counter() - start)
+
+    def report(self, elapsed):
+        overall = EndpointStats()
+        for stats in self.stats.values():
+            overall.histogram.merge(stats.histogram)
+            overall.statuses.update(stats.statuses)
+            overall.errors += stats.errors
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'concurrency': self.concurrency,
+            'overall': overall.summary(elapsed),
+            'endpoints': {name: stats.summary(elapsed) for name, stats in self.stats.items()},
+            'histograms': {
+                name: [
+                    {'percentile': percent, 'latency_ms': round(value, 3), 'count': count}
+                    for percent, value, count in stats.histogram.distribution()
+                ]
+                for name, stats in self.stats.items()
+                if stats.histogram.total
+            },
+        }
@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from patients.benchmarks import find_regressions, measure_startup, run_benchmarks
+from patients.services import api_client
+from patients.stub_api import StubPatientAPI
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the patient endpoints against seeded SQLite datasets and a local stub "
+        "of the external API, and fail when a hot path regresses against a JSON baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                            help="Comma-separated dataset sizes to seed, smallest first")
+        parser.add_argument('--iterations', type=int, default=5, help="Timed requests per endpoint")
+        parser.add_argument('--endpoints', default='', help="Comma-separated subset of endpoints to run")
+        parser.add_argument('--stub-latency', type=float, default=0.0, help="Stub API latency in seconds")
+        parser.add_argument('--stub-error-rate', type=float, default=0.0, help="Fraction of stub calls that fail")
+        parser.add_argument('--stub-page-size', type=int, default=10, help="Patients per stub API page")
+        parser.add_argument('--startup-runs', type=int, default=3,
+                            help="Fresh-process runs for the startup (cold vs warm start) measurement; 0 skips it")
+        parser.add_argument('--db-path', default=os.path.join(tempfile.gettempdir(), 'patients_benchmark.sqlite3'),
+                            help="SQLite file used for the seeded database (recreated on each run)")
+        parser.add_argument('--output', default='benchmark_results.json', help="Where to write this run's results")
+        parser.add_argument('--baseline', default='benchmark_baseline.json', help="Baseline to compare against")
+        parser.add_argument('--save-baseline', action='store_true', help="Write this run as the new baseline")
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help="Allowed relative slowdown/memory growth before a run fails")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size]
+        except ValueError:
+            raise CommandError("--sizes must be a comma-separated list of integers")
+        if options['iterations'] < 1:
+            raise CommandError("--iterations must be at least 1")
+        endpoints = {name for name in options['endpoints'].split(',') if name}
+
+        stub = StubPatientAPI(
+            latency=options['stub_latency'],
+            error_rate=options['stub_error_rate'],
+            page_size=options['stub_page_size'],
+        )
+        with stub, self._isolated_database(options['db_path']):
+            original_url = api_client.base_url
+            api_client.base_url = stub.url
+            try:
+                results = run_benchmarks(sizes, options['iterations'], endpoints, log=self.stdout.write)
+            finally:
+                api_client.base_url = original_url
+            
+            if options['startup_runs']:
+                results['startup'] = measure_startup(
+                    connections['default'].settings_dict['NAME'], stub.url, options['startup_runs']
+                )
+                for name, result in results['startup'].items():
+                    self.stdout.write(f"  startup {name:<20} p50={result['p50_ms']:>9.2f}ms max={result['max_ms']:>9.2f}ms")
+
+        Path(options['output']).write_text(json.dumps(results, indent=2))
+        self.stdout.write(f"Results written to {options['output']}")
+
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.write_text(json.dumps(results, indent=2))
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {baseline_path}"))
+            return
+        if not baseline_path.exists():
+            self.stdout.write(self.style.WARNING(f"No baseline at {baseline_path}; run with --save-baseline"))
+            return
+
+        regressions = find_regressions(results, json.loads(baseline_path.read_text()), options['threshold'])
+        if regressions:
+            raise CommandError("Performance regressions:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against baseline"))
+
+    @contextmanager
+    def _isolated_database(self, db_path):
+        """Run against a fresh, migrated SQLite file instead of the real database"""
+        setup_test_environment()
+        connection = connections['default']
+        old_name = connection.settings_dict['NAME']
+        connection.settings_dict['TEST'] = {**connection.settings_dict.get('TEST', {}), 'NAME': db_path}
+        test_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            if 'readonly' in connections:
+                connections['readonly'].close()
+                connections['readonly'].settings_dict['NAME'] = test_name
+            self.stdout.write(f"Benchmark database: {test_name}")
+            yield
+        finally:
+            if 'readonly' in connections:
+                connections['readonly'].close()
+                connections['readonly'].settings_dict['NAME'] = old_name
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
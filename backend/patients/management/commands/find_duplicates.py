@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from patients.services import api_client
+
+
+class Command(BaseCommand):
+    help = "Find likely duplicate patients by comparing rows within blocking-key blocks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Blocks fetched per query")
+        parser.add_argument('--json', action='store_true', help="Print each block as a JSON line")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        after = None
+        total_blocks = 0
+        while True:
+            data, status_code = api_client.find_duplicates(limit=options['batch_size'], after=after)
+            if status_code != 200:
+                raise CommandError(data.get('error', 'Failed to find duplicates'))
+            
+            for group in data['groups']:
+                total_blocks += 1
+                if options['json']:
+                    self.stdout.write(json.dumps(group))
+                else:
+                    names = ', '.join(
+                        f"{p['first_name']} {p['last_name']} ({p['third_party_id'] or p['id']})"
+                        for p in group['patients']
+                    )
+                    self.stdout.write(f"{group['blocking_key']}: {names}")
+            
+            after = data['next_after']
+            if not after:
+                break
+        
+        if not options['json']:
+            self.stdout.write(self.style.SUCCESS(f"Found {total_blocks} duplicate block(s)"))
@@ -0,0 +1,77 @@
+import json
+from pathlib import Path
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from patients.loadtest import DEFAULT_MIX, LoadTest
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive a mix of list/detail/create/copy/process/delete traffic at a target concurrency "
+        "against a running server and report throughput, latency percentiles and error/429 rates"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/api', help="Base URL of the running API")
+        parser.add_argument('--mix', default=DEFAULT_MIX, help="Weighted operation mix, e.g. list=80,detail=20")
+        parser.add_argument('--concurrency', type=int, default=8, help="Concurrent client threads")
+        parser.add_argument('--duration', type=float, default=30.0, help="Seconds to run for")
+        parser.add_argument('--requests', type=int, default=None, help="Stop after this many requests")
+        parser.add_argument('--timeout', type=float, default=30.0, help="Per-request timeout in seconds")
+        parser.add_argument('--output', default=None, help="Also write the full report as JSON")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency must be at least 1")
+        if options['duration'] <= 0:
+            raise CommandError("--duration must be greater than 0")
+        if options['requests'] is not None and options['requests'] < 1:
+            raise CommandError("--requests must be at least 1")
+        if options['timeout'] <= 0:
+            raise CommandError("--timeout must be greater than 0")
+        try:
+            load_test = LoadTest(
+                options['url'],
+                options['mix'],
+                concurrency=options['concurrency'],
+                duration=options['duration'],
+                max_requests=options['requests'],
+                timeout=options['timeout'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"Load testing {options['url']} with {options['concurrency']} workers...")
+        try:
+            report = load_test.run()
+        except requests.RequestException as e:
+            raise CommandError(f"Could not reach {options['url']}: {e}")
+
+        self._print_report(report)
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(report, indent=2))
+            self.stdout.write(f"Report written to {options['output']}")
+
+    def _print_report(self, report):
+        overall = report['overall']
+        self.stdout.write(
+            f"\n{overall['requests']} requests in {report['elapsed_s']}s "
+            f"({overall['throughput_rps']} req/s), errors {overall['error_rate']:.2%}, "
+            f"429s {overall['rate_limited_rate']:.2%}\n"
+        )
+        self.stdout.write(f"{'endpoint':<10} {'reqs':>7} {'req/s':>8} {'p50':>9} {'p95':>9} "
+                          f"{'p99':>9} {'max':>9} {'err':>7} {'429':>7}")
+        for name, summary in report['endpoints'].items():
+            self.stdout.write(
+                f"{name:<10} {summary['requests']:>7} {summary['throughput_rps']:>8} "
+                f"{summary['p50_ms']:>7.1f}ms {summary['p95_ms']:>7.1f}ms {summary['p99_ms']:>7.1f}ms "
+                f"{summary['max_ms']:>7.1f}ms {summary['error_rate']:>7.2%} {summary['rate_limited_rate']:>7.2%}"
+            )
+
+        for name, rows in report['histograms'].items():
+            self.stdout.write(f"\n{name} latency histogram")
+            self.stdout.write(f"  {'percentile':>10} {'value(ms)':>11} {'count':>7}")
+            for row in rows:
+                self.stdout.write(f"  {row['percentile']:>10} {row['latency_ms']:>11.3f} {row['count']:>7}")
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from patients.stub_api import StubPatientAPI
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local stub of the third-party patient API. Point the backend at it with "
+        "EXTERNAL_API_URL=http://127.0.0.1:<port>/api"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8100)
+        parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to every response")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests that return 500")
+        parser.add_argument('--page-size', type=int, default=10, help="Patients per list page")
+        parser.add_argument('--total', type=int, default=100, help="Number of external patients served")
+        parser.add_argument('--rate-limit', type=int, default=None, help="Requests per minute before 429s")
+
+    def handle(self, *args, **options):
+        stub = StubPatientAPI(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            page_size=options['page_size'],
+            total_patients=options['total'],
+            rate_limit_per_minute=options['rate_limit'],
+        )
+        self.stdout.write(f"Stub patient API listening on {stub.url} (Ctrl+C to stop)")
+        try:
+            stub.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,187 @@
+"""
+In-process request timing and Prometheus metrics for the patients API.
+
+Code on the request path records time into named phases (db, external,
+cache, serialize) with `timed()`; TimingMiddleware turns those phases into
+a Server-Timing header and feeds the histograms below, which /metrics
+renders in the Prometheus text format. Metrics are per process - scrape
+each worker, or run a single worker when comparing numbers.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Phase name -> seconds spent in it during the current request
+_request_phases = ContextVar('request_phases', default=None)
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] += amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.label_names), 0.0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def count(self, **labels):
+        series = self._series.get(tuple(str(labels[name]) for name in self.label_names))
+        return series['count'] if series else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, series['buckets']):
+                    labels = _format_labels(self.label_names, key, [('le', _format_value(bound))])
+                    lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+                labels = _format_labels(self.label_names, key)
+                lines.append(f'{self.name}_sum{labels} {_format_value(series["sum"])}')
+                lines.append(f'{self.name}_count{labels} {series["count"]}')
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    'patients_http_request_duration_seconds',
+    'Time spent handling API requests.',
+    labels=('view', 'method', 'status'),
+)
+REQUEST_PHASE_LATENCY = Histogram(
+    'patients_http_request_phase_duration_seconds',
+    'Time spent per request in each phase (db, external, cache, serialize).',
+    labels=('view', 'phase'),
+)
+REQUEST_QUERIES = Histogram(
+    'patients_http_request_queries',
+    'SQL queries run per request.',
+    labels=('view',),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+EXTERNAL_LATENCY = Histogram(
+    'patients_external_api_request_duration_seconds',
+    'Time spent on outbound calls to the third-party patient API.',
+    labels=('endpoint', 'method', 'status'),
+)
+EXTERNAL_ERRORS = Counter(
+    'patients_external_api_errors_total',
+    'Outbound calls to the third-party patient API that failed or returned an error status.',
+    labels=('endpoint', 'method'),
+)
+CACHE_REQUESTS = Counter(
+    'patients_cache_requests_total',
+    'Cache lookups by cache and result (hit or miss).',
+    labels=('cache', 'result'),
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    'patients_rate_limit_rejections_total',
+    'Requests rejected by the local process rate limiter.',
+)
+EVENTS_DROPPED = Counter(
+    'patients_events_dropped_total',
+    'Events discarded because a stream subscriber fell too far behind.',
+)
+
+REGISTRY = [
+    REQUEST_LATENCY,
+    REQUEST_PHASE_LATENCY,
+    REQUEST_QUERIES,
+    EXTERNAL_LATENCY,
+    EXTERNAL_ERRORS,
+    CACHE_REQUESTS,
+    RATE_LIMIT_REJECTIONS,
+    EVENTS_DROPPED,
+]
+
+
+def render_prometheus():
+    """Render every registered metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def start_request_timing():
+    """Start collecting phase timings for the current request; returns a reset token"""
+    return _request_phases.set(defaultdict(float))
+
+
+def finish_request_timing(token):
+    """Stop collecting and return the phase timings recorded for the request"""
+    phases = _request_phases.get() or {}
+    _request_phases.reset(token)
+    return dict(phases)
+
+
+def record_phase(phase, seconds):
+    """Add time to a phase of the current request (no-op outside a request)"""
+    phases = _request_phases.get()
+    if phases is not None:
+        phases[phase] += seconds
+
+
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
+
+
+def time_db_query(execute, sql, params, many, context):
+    """connection.execute_wrapper hook that records SQL time into the db phase"""
+    with timed('db'):
+        return execute(sql, params, many, context)
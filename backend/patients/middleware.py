@@ -0,0 +1,131 @@
+import gzip
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+from .metrics import (
+    REQUEST_LATENCY,
+    REQUEST_PHASE_LATENCY,
+    REQUEST_QUERIES,
+    finish_request_timing,
+    start_request_timing,
+    time_db_query,
+    timed,
+)
+from .query_budget import log_queries
+
+
+class TimingMiddleware:
+    """
+    Time each request by phase and report it in a Server-Timing header,
+    e.g. `db;dur=1.2, external;dur=240.5, serialize;dur=3.1, total;dur=251.0`
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = start_request_timing()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(time_db_query))
+                response = self.get_response(request)
+        finally:
+            phases = finish_request_timing(token)
+        total = time.perf_counter() - start
+        
+        view = request.resolver_match.url_name if request.resolver_match else 'unmatched'
+        REQUEST_LATENCY.observe(total, view=view, method=request.method, status=response.status_code)
+        for phase, seconds in phases.items():
+            REQUEST_PHASE_LATENCY.observe(seconds, view=view, phase=phase)
+        
+        entries = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in sorted(phases.items())]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        response['Server-Timing'] = ', '.join(entries)
+        return response
+
+
+class QueryLogMiddleware:
+    """Count the queries each request runs and log the slow ones with the view that ran them"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        def view_name():
+            return request.resolver_match.view_name if request.resolver_match else request.path
+
+        with log_queries(view_name) as query_log:
+            response = self.get_response(request)
+        
+        REQUEST_QUERIES.observe(query_log.count, view=view_name())
+        return response
+
+
+def _accepted_encodings(header):
+    """Map each encoding in an Accept-Encoding header to its q-value"""
+    encodings = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            encodings[name.strip().lower()] = quality
+    return encodings
+
+
+class CompressionMiddleware:
+    """
+    Compress responses of at least COMPRESSION_MIN_SIZE bytes with the best
+    encoding the client accepts: brotli (when installed), then gzip
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _choose_encoding(self, request):
+        accepted = _accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        candidates = (['br'] if brotli is not None else []) + ['gzip']
+        candidates = [name for name in candidates if accepted.get(name, accepted.get('*', 0)) > 0]
+        return max(candidates, key=lambda name: accepted.get(name, accepted.get('*', 0)), default=None)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        
+        encoding = self._choose_encoding(request)
+        if encoding is None:
+            return response
+        with timed('compress'):
+            if encoding == 'br':
+                content = brotli.compress(response.content, quality=settings.BROTLI_QUALITY)
+            else:
+                content = gzip.compress(response.content, compresslevel=settings.GZIP_LEVEL, mtime=0)
+        if len(content) >= len(response.content):
+            return response
+        
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = encoding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.25 on 2026-10-19 01:44
+
+import unicodedata
+from datetime import date, datetime, timezone as dt_timezone
+
+from dateutil import parser
+from django.db import migrations, models
+
+
+# Frozen copy of patients.models.build_blocking_key as of this migration
+def build_blocking_key(first_name, last_name, dob):
+    names = []
+    for name in (first_name, last_name):
+        name = unicodedata.normalize('NFKD', '' if name is None else str(name).casefold())
+        names.append(''.join(c for c in name if c.isalpha() and not unicodedata.combining(c)))
+    if not any(names):
+        return ''
+    
+    if dob and not isinstance(dob, date):
+        try:
+            dob = parser.parse(str(dob))
+        except (ValueError, OverflowError):
+            dob = None
+    if isinstance(dob, datetime):
+        # The database stores UTC; use the UTC date so save() and a backfill agree
+        if dob.tzinfo is not None:
+            dob = dob.astimezone(dt_timezone.utc)
+        dob_part = dob.date().isoformat()
+    elif isinstance(dob, date):
+        dob_part = dob.isoformat()
+    else:
+        dob_part = ''
+    
+    return '|'.join(sorted(names) + [dob_part])
+
+
+def backfill_blocking_keys(apps, schema_editor):
+    Patient = apps.get_model('patients', 'Patient')
+    batch = []
+    for patient in Patient.objects.only('id', 'first_name', 'last_name', 'dob').iterator(chunk_size=2000):
+        patient.blocking_key = build_blocking_key(patient.first_name, patient.last_name, patient.dob)
+        batch.append(patient)
+        if len(batch) >= 2000:
+            Patient.objects.bulk_update(batch, ['blocking_key'])
+            batch = []
+    if batch:
+        Patient.objects.bulk_update(batch, ['blocking_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='blocking_key',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.RunPython(backfill_blocking_keys, migrations.RunPython.noop),
+    ]
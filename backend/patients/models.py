@@ -1,6 +1,45 @@
 from django.db import models
+from django.utils import timezone
+from datetime import date, datetime, timezone as dt_timezone
+from dateutil import parser
+import unicodedata
 import uuid
 
+
+def build_blocking_key(first_name, last_name, dob):
+    """
+    Build the duplicate-detection blocking key for a patient
+    Names are casefolded, stripped of accents (combining marks) and of
+    anything that isn't a letter - in any script - and sorted so a swapped
+    first/last name lands in the same block, then joined with the DOB date:
+    "ada|lovelace|1990-01-01" (the DOB date in UTC). Returns '' when no name letters are left, so
+    such patients aren't all blocked together by DOB alone.
+    """
+    names = []
+    for name in (first_name, last_name):
+        name = unicodedata.normalize('NFKD', '' if name is None else str(name).casefold())
+        names.append(''.join(c for c in name if c.isalpha() and not unicodedata.combining(c)))
+    if not any(names):
+        return ''
+    
+    if dob and not isinstance(dob, date):
+        try:
+            dob = parser.parse(str(dob))
+        except (ValueError, OverflowError):
+            dob = None
+    if isinstance(dob, datetime):
+        # The database stores UTC; use the UTC date so save() and a backfill agree
+        if dob.tzinfo is not None:
+            dob = dob.astimezone(dt_timezone.utc)
+        dob_part = dob.date().isoformat()
+    elif isinstance(dob, date):
+        dob_part = dob.isoformat()
+    else:
+        dob_part = ''
+    
+    return '|'.join(sorted(names) + [dob_part])
+
+
 class Patient(models.Model):
     SEX_CHOICES = [
         ('male', 'Male'),
@@ -16,14 +55,33 @@ class Patient(models.Model):
     sex = models.CharField(max_length=10, choices=SEX_CHOICES)
     ethnic_background = models.CharField(max_length=100)
     
+    # Normalized name + DOB, used to find likely duplicates block by block
+    blocking_key = models.CharField(max_length=255, blank=True, default='', db_index=True)
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Keys of the API representation, in to_dict() order
+    API_FIELDS = (
+        'id', 'third_party_id', 'first_name', 'last_name', 'dob', 'sex',
+        'ethnic_background', 'source', 'can_delete', 'created_at',
+    )
+    # API keys computed from other columns rather than stored
+    DERIVED_FIELDS = {'source': ('third_party_id',), 'can_delete': ()}
+    
     class Meta:
         db_table = 'patients'
         ordering = ['-created_at']
     
+    def save(self, *args, **kwargs):
+        self.refresh_blocking_key()
+        super().save(*args, **kwargs)
+    
+    def refresh_blocking_key(self):
+        """Recompute the blocking key - bulk_create skips save(), so call this first"""
+        self.blocking_key = build_blocking_key(self.first_name, self.last_name, self.dob)
+    
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.third_party_id or 'local'})"
     
@@ -40,4 +98,83 @@ class Patient(models.Model):
             'source': 'both' if self.third_party_id else 'local',  # More accurate source
             'can_delete': True,  # All local patients can be deleted
             'created_at': self.created_at.isoformat() if self.created_at else None
-        }
\ No newline at end of file
+        }
+    
+    @classmethod
+    def columns_for(cls, fields):
+        """Database columns needed to build the given API fields"""
+        columns = []
+        for field in fields:
+            for column in cls.DERIVED_FIELDS.get(field, (field,)):
+                if column not in columns:
+                    columns.append(column)
+        return columns
+    
+    @classmethod
+    def values_to_dict(cls, row, fields=API_FIELDS):
+        """Build the to_dict() representation of a values() row, limited to fields"""
+        data = {}
+        for field in fields:
+            if field == 'id':
+                data['id'] = str(row['id'])
+            elif field in ('dob', 'created_at'):
+                data[field] = row[field].isoformat() if row[field] else None
+            elif field == 'source':
+                data['source'] = 'both' if row['third_party_id'] else 'local'
+            elif field == 'can_delete':
+                data['can_delete'] = True
+            else:
+                data[field] = row[field]
+        return data
+
+
+class ProcessJob(models.Model):
+    """A queued POST /patients/{id}/process call, run by the workers in jobs.py"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    patient_id = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Queued jobs wait until this time (retry backoff)
+    run_after = models.DateTimeField(default=timezone.now)
+    
+    # Outcome of the last attempt
+    result = models.JSONField(null=True, blank=True)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'process_jobs'
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'run_after'], name='process_jobs_queue_idx')]
+    
+    def __str__(self):
+        return f"Process job {self.id} for {self.patient_id} ({self.status})"
+    
+    def to_dict(self):
+        """Convert model instance to dictionary for API response"""
+        return {
+            'id': str(self.id),
+            'patient_id': self.patient_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'result': self.result,
+            'status_code': self.status_code,
+            'run_after': self.run_after.isoformat() if self.status == self.QUEUED and self.run_after else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
@@ -0,0 +1,75 @@
+"""
+Query instrumentation for the patients app, built on execute_wrapper.
+
+QueryLog counts the SQL run while it is installed and logs statements
+slower than settings.SLOW_QUERY_THRESHOLD_MS. @query_budget declares how
+many queries a view may run: going over raises QueryBudgetExceeded when
+settings.QUERY_BUDGET_RAISE is set (always under `manage.py test`) and
+logs a warning otherwise, so N+1 loops are caught before production.
+"""
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('patients.queries')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryLog:
+    def __init__(self, label, log_slow=True):
+        self.label = label
+        self.log_slow = log_slow
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            duration_ms = (time.perf_counter() - start) * 1000
+            if self.log_slow and duration_ms >= settings.SLOW_QUERY_THRESHOLD_MS:
+                label = self.label() if callable(self.label) else self.label
+                logger.warning("Slow query (%.1fms) in %s: %s", duration_ms, label, sql)
+
+
+@contextmanager
+def log_queries(label, log_slow=True):
+    """Install a QueryLog on every database connection for the block"""
+    query_log = QueryLog(label, log_slow)
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(query_log))
+        yield query_log
+
+
+def query_budget(max_queries):
+    """
+    Declare the most queries a view may run; max_queries is an int or a
+    callable taking the request (for views whose work scales in batches)
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            budget = max_queries(request) if callable(max_queries) else max_queries
+            with log_queries(view.__name__, log_slow=False) as query_log:
+                response = view(request, *args, **kwargs)
+            if query_log.count > budget:
+                message = (
+                    f"{view.__name__} ran {query_log.count} queries "
+                    f"({request.method} {request.path}), over its budget of {budget}"
+                )
+                if settings.QUERY_BUDGET_RAISE:
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message)
+            return response
+        wrapped.query_budget = max_queries
+        return wrapped
+    return decorator
@@ -0,0 +1,11 @@
+from rest_framework.renderers import JSONRenderer
+
+from .metrics import timed
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer that records rendering time in the serialize phase"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('serialize'):
+            return super().render(data, accepted_media_type, renderer_context)
@@ -1,13 +1,29 @@
 import requests
 import json
+import logging
+import os
+import re
 from django.core.cache import cache
+from django.db.models import Count
 from django.conf import settings
 import time
 from urllib.parse import urlencode
 from datetime import datetime
+from .events import broker
 from .models import Patient
+from .metrics import CACHE_REQUESTS, EXTERNAL_ERRORS, EXTERNAL_LATENCY, RATE_LIMIT_REJECTIONS, timed
 from dateutil import parser
 
+logger = logging.getLogger('patients.services')
+
+# Error returned when the local process rate budget is spent (as opposed to
+# a 429 from the third-party API)
+RATE_LIMIT_ERROR = "Rate limit exceeded. Please try again later."
+
+# third_party_ids per existence lookup in a bulk copy; stays under SQLite's
+# 999 bound-variable limit
+COPY_LOOKUP_BATCH_SIZE = 900
+
 
 class PatientAPIClient:
     def __init__(self):
@@ -21,12 +37,18 @@ class PatientAPIClient:
             query_string = urlencode(params)
             url = f"{url}?{query_string}"
         
+        start = time.perf_counter()
+        status_label = 'error'
         try:
-            response = self.session.get(url, timeout=10)
+            with timed('external'):
+                response = self.session.get(url, timeout=10)
+            status_label = response.status_code
             response.raise_for_status()
             return response.json(), response.status_code
         except requests.exceptions.RequestException as e:
             return {"error": f"Failed to fetch data: {str(e)}"}, 500
+        finally:
+            self._record_external_call(endpoint, 'GET', status_label, time.perf_counter() - start)
     
     def _make_post_request(self, endpoint, data):
         """Generic method to make POST API requests"""
@@ -35,18 +57,31 @@ class PatientAPIClient:
         # Convert any datetime objects to ISO strings
         serializable_data = self._make_json_serializable(data)
         
+        start = time.perf_counter()
+        status_label = 'error'
         try:
-            response = self.session.post(
-                url, 
-                json=serializable_data,
-                timeout=30
-            )
+            with timed('external'):
+                response = self.session.post(
+                    url, 
+                    json=serializable_data,
+                    timeout=30
+                )
+            status_label = response.status_code
             response.raise_for_status()
             return response.json(), response.status_code
         except requests.exceptions.RequestException as e:
             if hasattr(e, 'response') and e.response is not None:
                 return {"error": f"Failed to create patient: {e.response.text}"}, e.response.status_code
             return {"error": f"Failed to create patient: {str(e)}"}, 500
+        finally:
+            self._record_external_call(endpoint, 'POST', status_label, time.perf_counter() - start)
+    
+    def _record_external_call(self, endpoint, method, status_label, seconds):
+        """Record latency and errors for an outbound call, grouped by endpoint"""
+        endpoint_label = re.sub(r'^patients/[^/]+', 'patients/{id}', endpoint)
+        EXTERNAL_LATENCY.observe(seconds, endpoint=endpoint_label, method=method, status=status_label)
+        if status_label == 'error' or status_label >= 400:
+            EXTERNAL_ERRORS.inc(endpoint=endpoint_label, method=method)
     
     def _make_json_serializable(self, data):
         """Convert datetime objects to ISO format strings for JSON serialization"""
@@ -59,33 +94,52 @@ class PatientAPIClient:
         else:
             return data
     
-    def get_combined_patients(self, page=None):
+    def _external_page_cache_key(self, page):
+        version = cache.get_or_set('external_patients_version', 1, None)
+        return f"external_patients_v{version}_page_{page}"
+    
+    def get_external_page(self, page):
+        """Fetch a page of third-party patients, served from cache for EXTERNAL_LIST_CACHE_TIMEOUT"""
+        cache_key = self._external_page_cache_key(page)
+        with timed('cache'):
+            cached_page = cache.get(cache_key)
+        if cached_page is not None:
+            CACHE_REQUESTS.inc(cache='external_list', result='hit')
+            return cached_page, 200
+        CACHE_REQUESTS.inc(cache='external_list', result='miss')
+        
+        data, status_code = self._make_get_request("patients", {'page': page})
+        if status_code == 200 and "error" not in data and settings.EXTERNAL_LIST_CACHE_TIMEOUT:
+            with timed('cache'):
+                cache.set(cache_key, data, settings.EXTERNAL_LIST_CACHE_TIMEOUT)
+        return data, status_code
+    
+    def get_combined_patients(self, page=None, fields=None):
         """
         Get patients from both local database and third-party API
         Returns a unified list where all patients have consistent structure
+        Pass fields to return only those keys; local rows then only select
+        the columns they need
         """
+        fields = fields or Patient.API_FIELDS
         try:
-            # Get patients from local database
-            local_patients = Patient.objects.all()
-            local_patient_dicts = [patient.to_dict() for patient in local_patients]
+            # Get patients from local database - third_party_id is always
+            # selected because the merge below needs it
+            columns = Patient.columns_for(list(fields) + ['third_party_id'])
+            local_rows = list(Patient.objects.values(*columns))
+            local_patient_dicts = [Patient.values_to_dict(row, fields) for row in local_rows]
+            local_third_party_ids = {str(row['third_party_id']) for row in local_rows if row['third_party_id']}
             
             # Get patients from third-party API - ALWAYS pass a page number
             api_page = page if page is not None else 1
-            third_party_data, status_code = self._make_get_request("patients", {'page': api_page})
+            third_party_data, status_code = self.get_external_page(api_page)
             
             third_party_patients = []
             if status_code == 200 and "error" not in third_party_data:
                 # Transform third-party patients to match our structure
                 for tp_patient in third_party_data.get('patients', []):
                     # Check if this third-party patient exists in our local DB
-                    local_match = None
-                    for local_patient in local_patients:
-                        if (local_patient.third_party_id and 
-                            str(local_patient.third_party_id) == str(tp_patient.get('id'))):
-                            local_match = local_patient
-                            break
-                    
-                    if local_match:
+                    if str(tp_patient.get('id')) in local_third_party_ids:
                         # Skip - we'll use the local version which already has source='both'
                         continue
                     else:
@@ -110,16 +164,7 @@ class PatientAPIClient:
                             'can_delete': False,  # External patients can't be deleted
                             'created_at': None  # External patients don't have created_at
                         }
-                        third_party_patients.append(unified_patient)
-            
-            # Mark local patients for delete capability and ensure source is correct
-            for patient in local_patient_dicts:
-                patient['can_delete'] = True
-                # Ensure source is accurate - if third_party_id exists, it's 'both', else 'local'
-                if patient.get('third_party_id'):
-                    patient['source'] = 'both'
-                else:
-                    patient['source'] = 'local'
+                        third_party_patients.append({key: unified_patient[key] for key in fields})
             
             # Combine the lists - local patients first, then external
             combined_patients = local_patient_dicts + third_party_patients
@@ -138,20 +183,23 @@ class PatientAPIClient:
             
         except Exception as e:
             return {"error": f"Failed to get combined patients: {str(e)}"}, 500
-    def get_patient(self, patient_id):
+    def get_patient(self, patient_id, fields=None):
         """
         Get patient by ID - try local database first, then third-party API
+        Pass fields to return only those keys
         """
+        fields = fields or Patient.API_FIELDS
+        local_patients = Patient.objects.values(*Patient.columns_for(fields))
         # Try to get from local database first (by UUID or third_party_id)
         try:
             # Check if it's a UUID (local patient)
             if len(patient_id) == 36:  # UUID length
-                patient = Patient.objects.get(id=patient_id)
-                return patient.to_dict(), 200
+                row = local_patients.get(id=patient_id)
+                return Patient.values_to_dict(row, fields), 200
             else:
                 # Try to find by third_party_id
-                patient = Patient.objects.get(third_party_id=patient_id)
-                return patient.to_dict(), 200
+                row = local_patients.get(third_party_id=patient_id)
+                return Patient.values_to_dict(row, fields), 200
         except (Patient.DoesNotExist, ValueError):
             pass
         
@@ -172,7 +220,7 @@ class PatientAPIClient:
                 'can_delete': False,
                 'created_at': None
             }
-            return unified_patient, 200
+            return {key: unified_patient[key] for key in fields}, 200
         
         return data, status_code
    
@@ -215,17 +263,20 @@ class PatientAPIClient:
                 if status_code == 201 and 'id' in third_party_response:
                     local_patient.third_party_id = third_party_response['id']
                     local_patient.save()
+                    self._invalidate_patients_cache()
                     
                     # Update the response to include our local ID
                     third_party_response['local_id'] = str(local_patient.id)
                     third_party_response['source'] = 'both'
                     
+                    broker.publish('patient.created', {'patient': local_patient.to_dict()})
                     return third_party_response, 201
                 else:
                     # Third-party API failed, but we have local copy
                     response_data = local_patient.to_dict()
                     response_data['third_party_sync'] = False
                     response_data['third_party_error'] = third_party_response.get('error', 'Unknown error')
+                    broker.publish('patient.created', {'patient': local_patient.to_dict()})
                     return response_data, 201
                     
             except Exception as e:
@@ -236,12 +287,16 @@ class PatientAPIClient:
             cache_key = f"patient_process_{patient_id}_{hash(json.dumps(process_data, sort_keys=True))}"
             
             # Check cache first
-            cached_result = cache.get(cache_key)
+            with timed('cache'):
+                cached_result = cache.get(cache_key)
             if cached_result:
+                CACHE_REQUESTS.inc(cache='process_result', result='hit')
                 return cached_result, 200
+            CACHE_REQUESTS.inc(cache='process_result', result='miss')
             
             # Rate limiting check
-            recent_calls = cache.get('process_calls', [])
+            with timed('cache'):
+                recent_calls = cache.get('process_calls', [])
             current_time = time.time()
             
             # Remove calls older than 1 minute
@@ -249,23 +304,40 @@ class PatientAPIClient:
             
             # Check if we're over the limit
             if len(recent_calls) >= settings.RATE_LIMIT_PER_MINUTE:
-                return {"error": "Rate limit exceeded. Please try again later."}, 429
+                RATE_LIMIT_REJECTIONS.inc()
+                return {"error": RATE_LIMIT_ERROR}, 429
             
             # Make the external API call with the process data
             result, status_code = self._make_post_request(f"patients/{patient_id}/process", process_data)
             
             # Cache successful results
             if status_code == 200 and "error" not in result:
-                cache.set(cache_key, result, settings.CACHE_TIMEOUT)
-                # Update rate limit tracking
-                recent_calls.append(current_time)
-                cache.set('process_calls', recent_calls, 60)
+                with timed('cache'):
+                    cache.set(cache_key, result, settings.CACHE_TIMEOUT)
+                    # Update rate limit tracking
+                    recent_calls.append(current_time)
+                    cache.set('process_calls', recent_calls, 60)
+                broker.publish('process.completed', {'patient_id': patient_id, 'result': result})
             
             return result, status_code
         
+    def rate_limit_delay(self):
+            """Seconds until the shared process rate budget has room again (0 if it has now)"""
+            with timed('cache'):
+                recent_calls = cache.get('process_calls', [])
+            current_time = time.time()
+            recent_calls = [t for t in recent_calls if current_time - t < 60]
+            if len(recent_calls) < settings.RATE_LIMIT_PER_MINUTE:
+                return 0
+            return 60 - (current_time - min(recent_calls))
+        
     def _invalidate_patients_cache(self):
             """Invalidate cache when patients are updated"""
-            pass
+            # Bumping the version orphans every cached external page at once
+            try:
+                cache.incr('external_patients_version')
+            except ValueError:
+                cache.set('external_patients_version', 2, None)
 
     def delete_patient(self, patient_id):
         """
@@ -276,6 +348,7 @@ class PatientAPIClient:
             # Try to delete from local database by UUID
             patient = Patient.objects.get(id=patient_id)
             patient.delete()
+            broker.publish('patient.deleted', {'id': str(patient_id)})
             
             return {"success": True, "message": "Patient deleted successfully"}, 200
             
@@ -285,6 +358,37 @@ class PatientAPIClient:
             return {"error": f"Failed to delete patient: {str(e)}"}, 500
     # Create a singleton instance
        
+    def _parse_copy_dob(self, dob_str):
+        """Parse a copied patient's dob - handle multiple formats"""
+        if not dob_str:
+            return None
+        try:
+            # Handle different date formats
+            if 'T' in dob_str:
+                # ISO format with time
+                if dob_str.endswith('Z'):
+                    return datetime.fromisoformat(dob_str.replace('Z', '+00:00'))
+                return parser.parse(dob_str)
+            # Date-only format: "1990-01-01"
+            if len(dob_str) == 10:  # YYYY-MM-DD
+                dob_str = dob_str + 'T00:00:00Z'
+                return datetime.fromisoformat(dob_str.replace('Z', '+00:00'))
+            return parser.parse(dob_str)
+        except (ValueError, TypeError, parser.ParserError) as e:
+            logger.warning("Could not parse date %r, setting it to None: %s", dob_str, e)
+            return None
+
+    def _build_local_copy_data(self, patient_data):
+        """Prepare model field values for a local copy of a patient"""
+        return {
+            'first_name': patient_data.get('first_name', ''),
+            'last_name': patient_data.get('last_name', ''),
+            'dob': self._parse_copy_dob(patient_data.get('dob', '')),
+            'sex': patient_data.get('sex', ''),
+            'ethnic_background': patient_data.get('ethnic_background', ''),
+            'third_party_id': patient_data.get('third_party_id')
+        }
+
     def create_local_patient_copy(self, patient_data):
         """
         Create a local copy of a patient from provided data
@@ -297,47 +401,134 @@ class PatientAPIClient:
                 if existing_patient:
                     return {"error": "This patient already exists in local database"}, 400
             
-            # Prepare data for local patient
-            local_patient_data = {
-                'first_name': patient_data.get('first_name', ''),
-                'last_name': patient_data.get('last_name', ''),
-                'dob': patient_data.get('dob', ''),
-                'sex': patient_data.get('sex', ''),
-                'ethnic_background': patient_data.get('ethnic_background', ''),
-                'third_party_id': third_party_id
-            }
-            
-            # Parse the date - handle multiple formats
-            if local_patient_data['dob']:
-                try:
-                    dob_str = local_patient_data['dob']
-                    
-                    # Handle different date formats
-                    if 'T' in dob_str:
-                        # ISO format with time
-                        if dob_str.endswith('Z'):
-                            local_patient_data['dob'] = datetime.fromisoformat(dob_str.replace('Z', '+00:00'))
-                        else:
-                            local_patient_data['dob'] = parser.parse(dob_str)
-                    else:
-                        # Date-only format: "1990-01-01"
-                        if len(dob_str) == 10:  # YYYY-MM-DD
-                            dob_str = dob_str + 'T00:00:00Z'
-                            local_patient_data['dob'] = datetime.fromisoformat(dob_str.replace('Z', '+00:00'))
-                        else:
-                            local_patient_data['dob'] = parser.parse(dob_str)
-                            
-                except (ValueError, TypeError, parser.ParserError) as e:
-                    print(f"Warning: Could not parse date '{local_patient_data['dob']}'. Setting to None. Error: {e}")
-                    local_patient_data['dob'] = None
-            else:
-                local_patient_data['dob'] = None
-            
             # Create the local patient
-            local_patient = Patient.objects.create(**local_patient_data)
+            local_patient = Patient.objects.create(**self._build_local_copy_data(patient_data))
             
-            return local_patient.to_dict(), 201
+            patient_dict = local_patient.to_dict()
+            broker.publish('patient.copied', {'patients': [patient_dict]})
+            return patient_dict, 201
             
         except Exception as e:
             return {"error": f"Failed to create local copy: {str(e)}"}, 500
-api_client = PatientAPIClient()
\ No newline at end of file
+
+    def create_local_patient_copies(self, patients_data):
+        """
+        Create local copies of many patients in a single pass
+        Existing rows are found with IN queries on third_party_id (one per
+        COPY_LOOKUP_BATCH_SIZE ids) and new rows are inserted with
+        bulk_create, so queries grow per batch rather than per patient
+        """
+        try:
+            third_party_ids = list({p.get('third_party_id') for p in patients_data if p.get('third_party_id')})
+            existing_ids = set()
+            for start in range(0, len(third_party_ids), COPY_LOOKUP_BATCH_SIZE):
+                existing_ids.update(
+                    Patient.objects.filter(third_party_id__in=third_party_ids[start:start + COPY_LOOKUP_BATCH_SIZE])
+                    .values_list('third_party_id', flat=True)
+                )
+            
+            results = []
+            new_patients = []
+            seen_ids = set()
+            for index, patient_data in enumerate(patients_data):
+                third_party_id = patient_data.get('third_party_id')
+                if third_party_id in existing_ids:
+                    results.append({
+                        "index": index,
+                        "third_party_id": third_party_id,
+                        "status": "exists",
+                        "error": "This patient already exists in local database"
+                    })
+                    continue
+                if third_party_id and third_party_id in seen_ids:
+                    results.append({
+                        "index": index,
+                        "third_party_id": third_party_id,
+                        "status": "duplicate",
+                        "error": "This patient appears more than once in the request"
+                    })
+                    continue
+                
+                local_patient_data = self._build_local_copy_data(patient_data)
+                if local_patient_data['dob'] is None:
+                    results.append({
+                        "index": index,
+                        "third_party_id": third_party_id,
+                        "status": "invalid",
+                        "error": "Missing or invalid date of birth"
+                    })
+                    continue
+                
+                seen_ids.add(third_party_id)
+                patient = Patient(**local_patient_data)
+                patient.refresh_blocking_key()
+                new_patients.append((index, patient))
+            
+            Patient.objects.bulk_create([patient for _, patient in new_patients])
+            for index, patient in new_patients:
+                results.append({
+                    "index": index,
+                    "third_party_id": patient.third_party_id,
+                    "status": "created",
+                    "patient": patient.to_dict()
+                })
+            results.sort(key=lambda r: r['index'])
+            if new_patients:
+                broker.publish('patient.copied', {
+                    'patients': [r['patient'] for r in results if r['status'] == 'created']
+                })
+            
+            created_count = len(new_patients)
+            return {
+                "results": results,
+                "created": created_count,
+                "skipped": len(results) - created_count
+            }, 201 if created_count else 200
+            
+        except Exception as e:
+            return {"error": f"Failed to create local copies: {str(e)}"}, 500
+
+    def find_duplicates(self, limit=100, after=None):
+        """
+        Find likely duplicate patients across local and mirrored external rows
+        Rows are only compared within a block (same normalized name + DOB), so
+        one GROUP BY on the indexed blocking_key finds the candidate blocks and
+        a second IN query loads their rows. Blocks are returned in key order;
+        pass the returned next_after to fetch the next page.
+        """
+        try:
+            blocks = Patient.objects.exclude(blocking_key='')
+            if after:
+                blocks = blocks.filter(blocking_key__gt=after)
+            duplicate_keys = list(
+                blocks.order_by('blocking_key')
+                .values('blocking_key')
+                .annotate(count=Count('id'))
+                .filter(count__gt=1)
+                .values_list('blocking_key', flat=True)[:limit]
+            )
+            
+            groups = {key: [] for key in duplicate_keys}
+            for patient in Patient.objects.filter(blocking_key__in=duplicate_keys).order_by('created_at'):
+                groups[patient.blocking_key].append(patient.to_dict())
+            
+            return {
+                "groups": [
+                    {"blocking_key": key, "count": len(patients), "patients": patients}
+                    for key, patients in groups.items()
+                ],
+                "next_after": duplicate_keys[-1] if len(duplicate_keys) == limit else None
+            }, 200
+            
+        except Exception as e:
+            return {"error": f"Failed to find duplicates: {str(e)}"}, 500
+api_client = PatientAPIClient()
+
+
+def _reset_session_after_fork():
+    """A forked child must not share the parent's pooled upstream sockets"""
+    api_client.session = requests.Session()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_session_after_fork)
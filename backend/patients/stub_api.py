@@ -0,0 +1,161 @@
+"""
+Local stand-in for the third-party patient API (EXTERNAL_API_URL).
+
+Used by the benchmark and load-test commands so runs do not depend on, or
+hammer, the real service. Latency, error rate, page size and rate limit
+are configurable.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubPatientAPI:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0,
+                 page_size=10, total_patients=100, rate_limit_per_minute=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.total_patients = total_patients
+        self.rate_limit_per_minute = rate_limit_per_minute
+        self.request_count = 0
+        self._calls = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @staticmethod
+    def patient(index):
+        """The external patient served for a given position"""
+        return {
+            'id': f"stub_{index}",
+            'first_name': 'Stub',
+            'last_name': f"Patient{index}",
+            'dob': f"19{50 + index % 50:02d}-01-01T00:00:00Z",
+            'sex': ('male', 'female', 'other')[index % 3],
+            'ethnic_background': 'unknown',
+        }
+
+    def _over_rate_limit(self):
+        if not self.rate_limit_per_minute:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            self._calls = [t for t in self._calls if now - t < 60]
+            if len(self._calls) >= self.rate_limit_per_minute:
+                return True
+            self._calls.append(now)
+        return False
+
+    def _route(self, method, path, query, body):
+        """Return (status, payload) for a request"""
+        match = re.fullmatch(r'/api/patients(?:/([^/]+))?(/process)?/?', path)
+        if not match:
+            return 404, {'error': 'Not found'}
+        patient_id, process = match.groups()
+
+        if method == 'GET' and patient_id is None:
+            page = max(int(query.get('page', ['1'])[0] or 1), 1)
+            start = (page - 1) * self.page_size
+            stop = min(start + self.page_size, self.total_patients)
+            return 200, {
+                'patients': [self.patient(i) for i in range(start, stop)],
+                'page': page,
+                'per_page': self.page_size,
+                'total': self.total_patients,
+            }
+        if method == 'GET' and not process:
+            index = patient_id[len('stub_'):] if patient_id.startswith('stub_') else ''
+            if index.isdigit() and int(index) < self.total_patients:
+                return 200, self.patient(int(index))
+            return 404, {'error': 'Patient not found'}
+        if method == 'POST' and patient_id is None:
+            return 201, {**body, 'id': f"stub_new_{uuid.uuid4().hex[:12]}"}
+        if method == 'POST' and process:
+            weight = body.get('weight', {}).get('value', 0)
+            height = body.get('height', {}).get('value', 1) or 1
+            bmi = weight / ((height / 100) ** 2)
+            return 200, {
+                'success': True,
+                'patient': body,
+                'results': [[day, round(bmi + day * 0.1, 2)] for day in range(10)],
+            }
+        return 405, {'error': 'Method not allowed'}
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately; avoid the delayed-ACK stall
+            disable_nagle_algorithm = True
+
+            def _respond(self, method):
+                with stub._lock:
+                    stub.request_count += 1
+                length = int(self.headers.get('Content-Length') or 0)
+                raw_body = self.rfile.read(length) if length else b''
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                if stub._over_rate_limit():
+                    status, payload = 429, {'error': 'Too many requests'}
+                elif stub.error_rate and random.random() < stub.error_rate:
+                    status, payload = 500, {'error': 'Injected failure'}
+                else:
+                    url = urlparse(self.path)
+                    try:
+                        body = json.loads(raw_body or b'{}')
+                    except ValueError:
+                        body = {}
+                    status, payload = stub._route(method, url.path, parse_qs(url.query), body)
+
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -1,3 +1,741 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from .events import EventBroker, broker, format_sse
+from . import jobs
+from .benchmarks import find_regressions, measure_endpoint, seed_patients
+from .loadtest import LatencyHistogram, parse_mix
+from .metrics import EXTERNAL_ERRORS
+from .models import Patient, ProcessJob, build_blocking_key
+from .query_budget import QueryBudgetExceeded, log_queries, query_budget
+from .services import RATE_LIMIT_ERROR, _reset_session_after_fork, api_client
+from .stub_api import StubPatientAPI
+from . import warmup
+from vesynta_backend.database import ReadOnlyRouter, apply_sqlite_pragmas, read_only_database
+
+
+def _external_patient(index, **overrides):
+    patient = {
+        'third_party_id': f'tp-{index}',
+        'first_name': 'Ada',
+        'last_name': f'Lovelace{index}',
+        'dob': '1990-01-01',
+        'sex': 'female',
+        'ethnic_background': 'british',
+    }
+    patient.update(overrides)
+    return patient
+
+
+class BulkCopyTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_bulk_copy_uses_constant_queries(self):
+        Patient.objects.create(**{**_external_patient(0), 'dob': '1990-01-01T00:00:00Z'})
+        payload = [_external_patient(i) for i in range(50)]
+        with self.assertNumQueries(2):
+            response = self.client.post('/api/patients/copy', payload, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 49)
+        self.assertEqual(response.data['skipped'], 1)
+        self.assertEqual(response.data['results'][0]['status'], 'exists')
+        self.assertEqual(Patient.objects.count(), 50)
+
+    def test_bulk_copy_of_a_thousand_patients_batches_lookups(self):
+        Patient.objects.create(**{**_external_patient(999), 'dob': '1990-01-01T00:00:00Z'})
+        payload = [_external_patient(i) for i in range(1000)]
+        # Two IN lookups (900 ids each) and eleven 99-row INSERTs
+        with self.assertNumQueries(13):
+            response = self.client.post('/api/patients/copy', payload, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 999)
+        self.assertEqual(response.data['results'][999]['status'], 'exists')
+
+    def test_bulk_copy_reports_per_item_status(self):
+        payload = [
+            _external_patient(1),
+            _external_patient(1),
+            {'first_name': 'Missing'},
+            _external_patient(2, dob=''),
+        ]
+        response = self.client.post('/api/patients/copy', payload, format='json')
+
+        statuses = [result['status'] for result in response.data['results']]
+        self.assertEqual(statuses, ['created', 'duplicate', 'invalid', 'invalid'])
+        self.assertEqual([r['index'] for r in response.data['results']], [0, 1, 2, 3])
+
+    def test_single_copy_still_supported(self):
+        response = self.client.post('/api/patients/copy', _external_patient(3), format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['third_party_id'], 'tp-3')
+
+
+class DuplicateDetectionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_blocking_key_normalizes_names_and_dob(self):
+        self.assertEqual(
+            build_blocking_key('Zoë', "O'Brien", '1990-01-01T08:30:00Z'),
+            build_blocking_key('obrien', 'ZOE', '1990-01-01'),
+        )
+
+    def test_blocking_key_keeps_non_latin_names(self):
+        keys = {
+            build_blocking_key('李', '王', '1990-01-01'),
+            build_blocking_key('Иван', 'Петров', '1990-01-01'),
+            build_blocking_key('محمد', 'علي', '1990-01-01'),
+        }
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(build_blocking_key('Иван', 'Петров', '1990-01-01'),
+                         build_blocking_key('ПЕТРОВ', 'иван', '1990-01-01'))
+
+    def test_blocking_key_uses_the_utc_date(self):
+        self.assertEqual(build_blocking_key('Ada', 'Lovelace', '1990-01-01T23:30:00-05:00'),
+                         'ada|lovelace|1990-01-02')
+        patient = Patient.objects.create(first_name='Ada', last_name='Lovelace', dob='1990-01-01T23:30:00-05:00',
+                                         sex='female', ethnic_background='british')
+        patient.refresh_from_db()
+        self.assertEqual(patient.blocking_key,
+                         build_blocking_key(patient.first_name, patient.last_name, patient.dob))
+
+    def test_non_string_names_are_copied(self):
+        response = self.client.post('/api/patients/copy', _external_patient(1, first_name=123), format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/api/patients/copy', [_external_patient(2, last_name=456)], format='json')
+        self.assertEqual(response.data['results'][0]['status'], 'created')
+
+    def test_find_duplicates_rejects_empty_batches(self):
+        with self.assertRaisesMessage(CommandError, '--batch-size must be at least 1'):
+            call_command('find_duplicates', batch_size=0)
+
+    def test_patients_without_name_letters_are_not_blocked(self):
+        self.assertEqual(build_blocking_key('-', '??', '1990-01-01'), '')
+        for _ in range(2):
+            Patient.objects.create(first_name='-', last_name='?', dob='1990-01-01T00:00:00Z',
+                                   sex='other', ethnic_background='unknown')
+        self.assertEqual(self.client.get('/api/patients/duplicates').data['groups'], [])
+
+    def test_finds_local_and_mirrored_duplicates(self):
+        Patient.objects.create(first_name='Ada', last_name='Lovelace', dob='1990-01-01T00:00:00Z',
+                               sex='female', ethnic_background='british')
+        self.client.post('/api/patients/copy', [_external_patient(1, last_name='LOVELACE')], format='json')
+        Patient.objects.create(first_name='Grace', last_name='Hopper', dob='1990-01-01T00:00:00Z',
+                               sex='female', ethnic_background='american')
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/patients/duplicates')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['groups']), 1)
+        group = response.data['groups'][0]
+        self.assertEqual(group['blocking_key'], 'ada|lovelace|1990-01-01')
+        self.assertEqual({p['source'] for p in group['patients']}, {'local', 'both'})
+
+
+class SQLiteProfileTests(SimpleTestCase):
+    """Mixed read/write behaviour of a file database with and without the profile"""
+    # Fixed, so the tests don't depend on SQLITE_PERFORMANCE_PROFILE
+    PROFILE = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'cache_size': -20000,
+    }
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(self._remove_files)
+
+    def _remove_files(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def _connect(self, pragmas, timeout=0):
+        conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        apply_sqlite_pragmas(conn.cursor(), pragmas)
+        return conn
+
+    def _prepare(self, pragmas):
+        conn = self._connect(pragmas)
+        conn.execute("CREATE TABLE IF NOT EXISTS t (id INTEGER PRIMARY KEY, v TEXT)")
+        conn.executemany("INSERT INTO t (v) VALUES (?)", [('x',)] * 1000)
+        return conn
+
+    def _mixed_workload(self, pragmas, duration=0.5, readers=3):
+        self._prepare(pragmas).close()
+        counts = {'reads': 0, 'read_errors': 0, 'writes': 0}
+        lock = threading.Lock()
+        stop = time.monotonic() + duration
+
+        def writer():
+            conn = self._connect(pragmas, timeout=5)
+            while time.monotonic() < stop:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany("INSERT INTO t (v) VALUES (?)", [('y',)] * 50)
+                conn.execute("COMMIT")
+                with lock:
+                    counts['writes'] += 1
+            conn.close()
+
+        def reader():
+            conn = self._connect({k: v for k, v in pragmas.items() if k != 'busy_timeout'})
+            while time.monotonic() < stop:
+                try:
+                    conn.execute("SELECT COUNT(*) FROM t WHERE v = 'x'").fetchone()
+                    key = 'reads'
+                except sqlite3.OperationalError:
+                    key = 'read_errors'
+                with lock:
+                    counts[key] += 1
+            conn.close()
+
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return counts
+
+    def test_wal_reads_are_not_blocked_by_a_writer(self):
+        for pragmas, blocked in (({}, True), (self.PROFILE, False)):
+            self._remove_files()
+            writer = self._prepare(pragmas)
+            reader = self._connect(pragmas, timeout=0)
+            writer.execute("BEGIN EXCLUSIVE")
+            writer.execute("INSERT INTO t (v) VALUES ('z')")
+            if blocked:
+                with self.assertRaisesMessage(sqlite3.OperationalError, 'locked'):
+                    reader.execute("SELECT COUNT(*) FROM t").fetchone()
+            else:
+                self.assertEqual(reader.execute("SELECT COUNT(*) FROM t").fetchone()[0], 1000)
+            writer.execute("COMMIT")
+            writer.close()
+            reader.close()
+
+    def test_profile_improves_mixed_read_write_throughput(self):
+        baseline = self._mixed_workload({})
+        self._remove_files()
+        profiled = self._mixed_workload(self.PROFILE)
+
+        message = f"default journal: {baseline}, performance profile: {profiled}"
+        self.assertEqual(profiled['read_errors'], 0, message)
+        self.assertGreater(profiled['reads'] + profiled['writes'], baseline['reads'] + baseline['writes'], message)
+
+    def test_django_connections_get_the_profile(self):
+        default = connections['default']
+        wrapper = type(default)({**default.settings_dict, 'NAME': self.path}, alias='default')
+        with self.settings(SQLITE_PRAGMAS=self.PROFILE):
+            try:
+                with wrapper.cursor() as cursor:
+                    applied = {}
+                    for name in ('journal_mode', 'synchronous', 'busy_timeout', 'temp_store', 'cache_size'):
+                        cursor.execute(f"PRAGMA {name}")
+                        applied[name] = cursor.fetchone()[0]
+            finally:
+                wrapper.close()
+        # synchronous NORMAL is 1, temp_store MEMORY is 2
+        self.assertEqual(applied, {
+            'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000, 'temp_store': 2, 'cache_size': -20000,
+        })
+
+
+class ReadOnlyRouterTests(SimpleTestCase):
+    def test_reads_route_to_readonly_alias_only_inside_block(self):
+        router = ReadOnlyRouter()
+        with mock.patch.dict(settings.DATABASES, {'readonly': settings.DATABASES['default']}):
+            self.assertIsNone(router.db_for_read(Patient))
+            with read_only_database():
+                self.assertEqual(router.db_for_read(Patient), 'readonly')
+                self.assertEqual(router.db_for_write(Patient), 'default')
+            self.assertFalse(router.allow_migrate('readonly', 'patients'))
+
+    def test_reads_stay_on_default_without_readonly_alias(self):
+        with read_only_database():
+            self.assertIsNone(ReadOnlyRouter().db_for_read(Patient))
+
+
+class TimingAndMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def _external_response(self, status_code, payload):
+        response = mock.Mock(status_code=status_code)
+        response.json.return_value = payload
+        response.raise_for_status.return_value = None
+        return response
+
+    def test_list_reports_server_timing_phases(self):
+        external = self._external_response(200, {'patients': [], 'page': 1, 'per_page': 10})
+        with mock.patch.object(api_client.session, 'get', return_value=external):
+            response = self.client.get('/api/patients')
+
+        phases = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(phases, ['cache', 'db', 'external', 'serialize', 'total'])
+
+    def test_metrics_endpoint_exposes_external_errors(self):
+        errors_before = EXTERNAL_ERRORS.value(endpoint='patients/{id}', method='GET')
+        with mock.patch.object(api_client.session, 'get', side_effect=requests.ConnectionError('down')):
+            self.client.get('/api/patients/abc123')
+
+        self.assertEqual(EXTERNAL_ERRORS.value(endpoint='patients/{id}', method='GET'), errors_before + 1)
+        response = self.client.get('/metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('patients_external_api_errors_total{endpoint="patients/{id}",method="GET"}', body)
+        self.assertIn('patients_http_request_duration_seconds_bucket{view="patient-detail",method="GET",status="500",le="+Inf"}', body)
+
+
+class BenchmarkToolingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_combined_list_against_stub_api(self):
+        seed_patients(25)
+        with StubPatientAPI(page_size=5) as stub, mock.patch.object(api_client, 'base_url', stub.url):
+            data, status_code = api_client.get_combined_patients(page=1)
+
+        self.assertEqual(status_code, 200)
+        # stub_0 is mirrored locally, so only four external-only patients remain
+        self.assertEqual(data['sources'], {'local_count': 25, 'third_party_count': 4, 'third_party_error': False})
+
+    def test_stub_api_injects_errors(self):
+        with StubPatientAPI(error_rate=1.0) as stub:
+            response = requests.get(f"{stub.url}/patients/stub_1", timeout=5)
+        self.assertEqual(response.status_code, 500)
+
+    def test_find_regressions(self):
+        baseline = {'1000': {'list': {'p50_ms': 10.0, 'queries': 1, 'peak_memory_kb': 100.0}}}
+        results = {'1000': {'list': {'p50_ms': 20.0, 'queries': 2, 'peak_memory_kb': 110.0}}}
+
+        self.assertEqual(find_regressions(results, baseline), [
+            'list @ 1000: p50 10.0ms -> 20.0ms',
+            'list @ 1000: queries 1 -> 2',
+        ])
+        self.assertEqual(find_regressions(baseline, baseline), [])
+
+    def test_status_change_is_a_regression(self):
+        baseline = {'1000': {'list': {'status': 200, 'p50_ms': 10.0, 'queries': 1, 'peak_memory_kb': 100.0}}}
+        results = {'1000': {'list': {'status': 500, 'p50_ms': 1.0, 'queries': 1, 'peak_memory_kb': 100.0}}}
+
+        self.assertEqual(find_regressions(results, baseline), ['list @ 1000: status 200 -> 500'])
+
+    def test_measure_endpoint_counts_queries_on_every_endpoint(self):
+        for _ in range(2):
+            Patient.objects.create(first_name='Ada', last_name='Lovelace', dob='1990-01-01T00:00:00Z',
+                                   sex='female', ethnic_background='british')
+        local_id = Patient.objects.first().id
+        client = Client()
+        for path, queries in ((f'/api/patients/{local_id}', 1), ('/api/patients/duplicates', 2)):
+            result = measure_endpoint(client, 'get', lambda: path, None, iterations=1)
+            self.assertEqual(result['status'], 200)
+            self.assertEqual(result['queries'], queries, path)
+        with self.assertRaisesMessage(ValueError, 'iterations must be at least 1'):
+            measure_endpoint(client, 'get', lambda: '/api/patients/duplicates', None, iterations=0)
+
+
+class LoadTestToolingTests(SimpleTestCase):
+    def test_histogram_percentiles(self):
+        histogram = LatencyHistogram()
+        for ms in range(1, 101):
+            histogram.record(ms / 1000)
+
+        self.assertEqual(histogram.percentile(50), 50.0)
+        self.assertEqual(histogram.percentile(99), 99.0)
+        self.assertEqual(histogram.distribution((95, 100)), [(95, 95.0, 95), (100, 100.0, 100)])
+
+    def test_parse_mix_rejects_unknown_operations(self):
+        self.assertEqual(parse_mix('list=3, detail=1'), {'list': 3.0, 'detail': 1.0})
+        with self.assertRaisesMessage(ValueError, "Unknown operation 'update'"):
+            parse_mix('list=1,update=1')
+        with self.assertRaisesMessage(ValueError, "Weight for 'detail' must not be negative"):
+            parse_mix('list=1,detail=-1')
+
+    def test_loadtest_command_rejects_empty_runs(self):
+        for option, value in (('concurrency', 0), ('duration', -1), ('requests', 0)):
+            with self.subTest(option=option), self.assertRaisesMessage(CommandError, f'--{option} must be'):
+                call_command('loadtest', **{option: value})
+        with self.assertRaisesMessage(CommandError, 'must not be negative'):
+            call_command('loadtest', mix='list=-1')
+
+
+class QueryBudgetTests(TestCase):
+    def _view(self, budget):
+        @query_budget(budget)
+        def list_twice(request):
+            list(Patient.objects.all())
+            list(Patient.objects.all())
+            return 'ok'
+        return list_twice
+
+    def test_over_budget_fails_under_tests(self):
+        request = RequestFactory().get('/api/patients')
+        self.assertEqual(self._view(2)(request), 'ok')
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'list_twice ran 2 queries (GET /api/patients), over its budget of 1'):
+            self._view(1)(request)
+
+    @override_settings(QUERY_BUDGET_RAISE=False)
+    def test_over_budget_warns_in_production(self):
+        with self.assertLogs('patients.queries', 'WARNING') as logs:
+            self._view(lambda request: 1)(RequestFactory().get('/api/patients'))
+        self.assertIn('over its budget of 1', logs.output[0])
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+    def test_slow_queries_are_logged_with_the_view(self):
+        with self.assertLogs('patients.queries', 'WARNING') as logs:
+            APIClient().get('/api/patients/duplicates')
+        self.assertIn('in duplicate-patients: SELECT', logs.output[0])
+
+
+
+class FreshConnectionQueryCountTests(SimpleTestCase):
+    """Outside TestCase, so each thread opens (and configures) a new connection"""
+    databases = {'default'}
+
+    def _count_in_new_thread(self):
+        counts = []
+
+        def run():
+            try:
+                with log_queries('fresh-connection', log_slow=False) as query_log:
+                    Patient.objects.count()
+                counts.append(query_log.count)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        return counts[0]
+
+    @override_settings(SQLITE_PRAGMAS={'busy_timeout': 5000, 'temp_store': 'MEMORY', 'cache_size': -2000})
+    def test_connection_setup_is_not_counted(self):
+        self.assertEqual(self._count_in_new_thread(), 1)
+
+
+class SparseFieldsetAndCompressionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.patient = Patient.objects.create(
+            first_name='Ada', last_name='Lovelace', dob='1990-01-01T00:00:00Z',
+            sex='female', ethnic_background='british', third_party_id='stub_0',
+        )
+        self.stub = StubPatientAPI(page_size=50, total_patients=50).start()
+        self.addCleanup(self.stub.stop)
+        patcher = mock.patch.object(api_client, 'base_url', self.stub.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_values_to_dict_matches_to_dict(self):
+        row = Patient.objects.values(*Patient.columns_for(Patient.API_FIELDS)).get()
+        self.patient.refresh_from_db()
+        self.assertEqual(Patient.values_to_dict(row), self.patient.to_dict())
+
+    def test_list_and_detail_return_only_requested_fields(self):
+        response = self.client.get('/api/patients?fields=id,source')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['patients'][0], {'id': str(self.patient.id), 'source': 'both'})
+        self.assertEqual(response.data['patients'][1], {'id': 'stub_1', 'source': 'third_party'})
+        # stub_0 is already local, so it is not listed twice
+        self.assertEqual(response.data['sources']['third_party_count'], 49)
+
+        response = self.client.get(f'/api/patients/{self.patient.id}?fields=first_name')
+        self.assertEqual(response.data, {'first_name': 'Ada'})
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get('/api/patients?fields=id,password')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Unknown fields: password')
+
+    def test_large_responses_are_gzipped_when_accepted(self):
+        plain = self.client.get('/api/patients')
+        compressed = self.client.get('/api/patients', HTTP_ACCEPT_ENCODING='gzip;q=1.0, identity;q=0.5')
+
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertLess(len(compressed.content), len(plain.content) / 3)
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get(f'/api/patients/{self.patient.id}', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class WarmStartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stub = StubPatientAPI().start()
+        self.addCleanup(self.stub.stop)
+        patcher = mock.patch.object(api_client, 'base_url', self.stub.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_warm_start_primes_external_page_cache(self):
+        # The warm-up thread can't see the test transaction; skip its table touch
+        with mock.patch.object(warmup, '_thread', None), mock.patch.object(Patient.objects, 'count'):
+            thread = warmup.warm_start(force=True)
+            thread.join(10)
+
+        self.assertIn('external_page', warmup.timings)
+        requests_before = self.stub.request_count
+        _, status_code = api_client.get_external_page(1)
+        self.assertEqual(status_code, 200)
+        self.assertEqual(self.stub.request_count, requests_before)
+
+    def test_forked_child_can_warm_again_with_its_own_session(self):
+        parent_session = api_client.session
+        self.addCleanup(setattr, api_client, 'session', parent_session)
+        with mock.patch.object(warmup, '_thread', mock.Mock()), mock.patch.object(warmup, '_forked', False):
+            _reset_session_after_fork()
+            warmup._reset_after_fork()
+            self.assertIsNone(warmup._thread)
+            self.assertTrue(warmup._forked)
+        self.assertIsNot(api_client.session, parent_session)
+
+    def test_preloading_master_does_not_warm(self):
+        with mock.patch.object(warmup, '_thread', None), mock.patch.object(warmup, '_forked', False), \
+                mock.patch.object(sys, 'argv', ['/usr/bin/gunicorn', '--preload', 'vesynta_backend.wsgi']):
+            self.assertIsNone(warmup.warm_start())
+            # After the fork, the post_fork hook warms the worker
+            with mock.patch.object(warmup, '_forked', True), mock.patch.object(warmup, '_run'):
+                self.assertIsNotNone(warmup.warm_start())
+
+    def test_disabled_without_setting(self):
+        with mock.patch.object(warmup, '_thread', None), self.settings(WARM_START=False):
+            self.assertIsNone(warmup.warm_start())
+
+    def test_creating_a_patient_invalidates_cached_pages(self):
+        api_client.get_external_page(1)
+        api_client.create_patient({
+            'first_name': 'Ada', 'last_name': 'Lovelace', 'dob': '1990-01-01T00:00:00Z',
+            'sex': 'female', 'ethnic_background': 'british',
+        })
+        requests_before = self.stub.request_count
+        api_client.get_external_page(1)
+        self.assertEqual(self.stub.request_count, requests_before + 1)
+
+
+class EventStreamTests(SimpleTestCase):
+    def test_publish_reaches_subscribers(self):
+        async def scenario():
+            broker = EventBroker()
+            subscription = broker.subscribe(buffer_size=10)
+            broker.publish('patient.deleted', {'id': 'abc'})
+            events = await subscription.get(timeout=1)
+            subscription.close()
+            return events, broker.subscriber_count
+
+        events, remaining = asyncio.run(scenario())
+        self.assertEqual([e['type'] for e in events], ['patient.deleted'])
+        self.assertEqual(events[0]['data'], {'id': 'abc'})
+        self.assertEqual(remaining, 0)
+
+    def test_slow_subscriber_gets_resync_instead_of_backlog(self):
+        async def scenario():
+            broker = EventBroker()
+            subscription = broker.subscribe(buffer_size=3)
+            for i in range(5):
+                broker.publish('patient.created', {'n': i})
+            first = await subscription.get(timeout=1)
+            broker.publish('patient.created', {'n': 5})
+            second = await subscription.get(timeout=1)
+            return first, second
+
+        first, second = asyncio.run(scenario())
+        self.assertEqual([e['type'] for e in first], ['resync'])
+        self.assertEqual([e['data'] for e in second], [{'n': 5}])
+
+    def test_get_times_out_empty_and_clients_are_capped(self):
+        async def scenario():
+            broker = EventBroker()
+            subscription = broker.subscribe()
+            with self.settings(EVENT_STREAM_MAX_CLIENTS=1):
+                rejected = broker.subscribe()
+            return await subscription.get(timeout=0.01), rejected
+
+        events, rejected = asyncio.run(scenario())
+        self.assertEqual(events, [])
+        self.assertIsNone(rejected)
+
+    def test_format_sse(self):
+        self.assertEqual(
+            format_sse({'id': 7, 'type': 'patient.deleted', 'data': {'id': 'abc'}}),
+            b'id: 7\nevent: patient.deleted\ndata: {"id": "abc"}\n\n',
+        )
+
+    def test_stream_endpoint_delivers_published_events(self):
+        async def scenario():
+            response = await AsyncClient().get('/api/events')
+            chunks = response.streaming_content.__aiter__()
+            first = await chunks.__anext__()
+            broker.publish('patient.deleted', {'id': 'abc'})
+            second = await chunks.__anext__()
+            await chunks.aclose()
+            return response, first, second
+
+        response, first, second = asyncio.run(scenario())
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue(first.startswith(b'retry: 3000\nid: '))
+        self.assertIn(b'event: patient.deleted', second)
+
+    def test_reconnect_resyncs_only_after_missed_events(self):
+        async def first_events(last_event_id):
+            response = await AsyncClient().get('/api/events', headers={'Last-Event-ID': last_event_id})
+            chunks = response.streaming_content.__aiter__()
+            hello = await chunks.__anext__()
+            broker.publish('patient.deleted', {'id': 'abc'})
+            following = await chunks.__anext__()
+            await chunks.aclose()
+            return hello, following
+
+        hello, following = asyncio.run(first_events(str(broker.last_id)))
+        self.assertIn(b'event: patient.deleted', following)
+        current_id = hello.split(b'id: ')[1].split(b'\n')[0].decode()
+
+        _, following = asyncio.run(first_events(str(int(current_id) - 1)))
+        self.assertIn(b'event: resync', following)
+
+    def test_stream_endpoint_is_no_content_under_wsgi(self):
+        response = self.client.get('/api/events')
+        self.assertEqual(response.status_code, 204)
+
+
+@override_settings(JOB_MAX_ATTEMPTS=2, JOB_WORKERS=2)
+class ProcessJobTests(TestCase):
+    PROCESS_DATA = {'weight': {'value': 70.0, 'unit': 'kg'}, 'height': {'value': 175.0, 'unit': 'cm'}}
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        # A stand-in pool: tests run jobs by hand with run_next_job()
+        patcher = mock.patch.object(jobs, '_pool', mock.Mock())
+        self.pool = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def queue_job(self):
+        response = self.client.post('/api/patients/p1/process?async=1', self.PROCESS_DATA, format='json')
+        self.assertEqual(response.status_code, 202)
+        return response.json()
+
+    def test_async_process_returns_job_to_poll(self):
+        with mock.patch.object(api_client, 'process_patient') as process:
+            job = self.queue_job()
+        process.assert_not_called()
+        self.pool.wake.assert_called_once_with()
+        self.assertEqual(job['status'], 'queued')
+        self.assertTrue(job['status_url'].endswith(f"/api/jobs/{job['id']}"))
+
+        response = self.client.get(f"/api/jobs/{job['id']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'queued')
+
+    def test_worker_runs_job_and_stores_result(self):
+        job = self.queue_job()
+        with mock.patch.object(api_client, 'process_patient', return_value=({'bmi': 22.9}, 200)) as process:
+            self.assertTrue(jobs.run_next_job())
+        process.assert_called_once_with('p1', self.PROCESS_DATA)
+
+        data = self.client.get(f"/api/jobs/{job['id']}").json()
+        self.assertEqual(data['status'], 'succeeded')
+        self.assertEqual(data['result'], {'bmi': 22.9})
+        self.assertEqual(data['attempts'], 1)
+        self.assertFalse(jobs.run_next_job())
+
+    def test_rate_limited_job_is_retried_after_backoff_then_fails(self):
+        job = self.queue_job()
+        with mock.patch.object(api_client, 'process_patient', return_value=({'error': 'Too many requests'}, 429)):
+            jobs.run_next_job()
+            queued = ProcessJob.objects.get(id=job['id'])
+            self.assertEqual(queued.status, ProcessJob.QUEUED)
+            self.assertGreater(queued.run_after, queued.updated_at)
+            # Not due yet
+            self.assertIsNone(jobs.claim_next_job())
+
+            ProcessJob.objects.filter(id=job['id']).update(run_after=queued.updated_at)
+            jobs.run_next_job()
+        failed = ProcessJob.objects.get(id=job['id'])
+        self.assertEqual(failed.status, ProcessJob.FAILED)
+        self.assertEqual(failed.attempts, 2)
+        self.assertEqual(failed.status_code, 429)
+
+    def test_client_errors_are_not_retried(self):
+        job = self.queue_job()
+        with mock.patch.object(api_client, 'process_patient', return_value=({'error': 'Not found'}, 404)):
+            jobs.run_next_job()
+        self.assertEqual(ProcessJob.objects.get(id=job['id']).status, ProcessJob.FAILED)
+
+    def test_jobs_wait_while_rate_budget_is_spent(self):
+        self.queue_job()
+        cache.set('process_calls', [time.time()] * settings.RATE_LIMIT_PER_MINUTE, 60)
+        with mock.patch.object(api_client, 'process_patient') as process:
+            self.assertFalse(jobs.run_next_job())
+        process.assert_not_called()
+        self.assertEqual(ProcessJob.objects.get().status, ProcessJob.QUEUED)
+
+    def test_local_rate_limit_race_does_not_use_an_attempt(self):
+        job = self.queue_job()
+        with mock.patch.object(api_client, 'process_patient', return_value=({'error': RATE_LIMIT_ERROR}, 429)):
+            jobs.run_next_job()
+        queued = ProcessJob.objects.get(id=job['id'])
+        self.assertEqual(queued.status, ProcessJob.QUEUED)
+        self.assertEqual(queued.attempts, 0)
+
+    @override_settings(JOB_WORKERS=1)
+    def test_starting_the_pool_runs_no_queries_in_the_request(self):
+        with mock.patch.object(jobs, '_pool', None), mock.patch.object(jobs.JobWorkerPool, '_work') as work:
+            self.queue_job()
+        work.assert_called_once_with(True)
+
+    def test_pool_starts_on_first_request_not_at_fork(self):
+        with mock.patch.object(jobs.JobWorkerPool, 'start') as start:
+            jobs._reset_after_fork()
+            self.assertIsNone(jobs._pool)
+            start.assert_not_called()
+
+            self.client.get('/api/jobs/not-a-uuid')
+        start.assert_called_once_with()
+        self.assertIsNotNone(jobs._pool)
+
+    @override_settings(JOB_WORKERS=0)
+    def test_async_process_is_unavailable_without_workers(self):
+        response = self.client.post('/api/patients/p1/process?async=1', self.PROCESS_DATA, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(ProcessJob.objects.exists())
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = ProcessJob.objects.create(patient_id='p1', payload=self.PROCESS_DATA, status=ProcessJob.RUNNING)
+        self.assertEqual(jobs.requeue_stale_jobs(), 0)
+        ProcessJob.objects.filter(id=job.id).update(updated_at=job.updated_at - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale_jobs(), 1)
+        self.assertEqual(ProcessJob.objects.get(id=job.id).status, ProcessJob.QUEUED)
+
+    def test_unknown_job_is_404(self):
+        self.assertEqual(self.client.get('/api/jobs/not-a-uuid').status_code, 404)
+        self.assertEqual(self.client.get('/api/jobs/00000000-0000-0000-0000-000000000000').status_code, 404)
@@ -5,11 +5,19 @@ urlpatterns = [
     # List and create patients
     path('patients', views.patient_list, name='patient-list'),
     
-    # Copy external patient (must come before detail routes to avoid conflicts)
+    # Live patient change / process result events (server-sent events)
+    path('events', views.patient_events, name='patient-events'),
+    
+    # Copy, duplicate and stats routes (must come before detail routes to avoid conflicts)
     path('patients/copy', views.copy_external_patient, name='copy-patient'),
+    path('patients/duplicates', views.duplicate_patients, name='duplicate-patients'),
+    path('patients/stats', views.local_patients_stats, name='patient-stats'),
     
     # Patient detail routes
     path('patients/<str:patient_id>', views.patient_detail, name='patient-detail'),
     path('patients/<str:patient_id>/process', views.process_patient, name='process-patient'),
     path('patients/<str:patient_id>/delete', views.delete_patient, name='delete-patient'),
+    
+    # Background process jobs (POST /patients/{id}/process?async=1)
+    path('jobs/<str:job_id>', views.job_detail, name='job-detail'),
 ]
\ No newline at end of file
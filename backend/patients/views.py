@@ -1,14 +1,46 @@
+import hashlib
+import math
+import time
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.urls import reverse
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from .services import api_client
+from .services import COPY_LOOKUP_BATCH_SIZE, api_client
 from .serializers import ProcessPatientSerializer, CreatePatientSerializer
 from .models import Patient
+from .events import RESYNC, broker, format_sse
+from .jobs import enqueue_process_job, get_job
+from .metrics import render_prometheus
+from .query_budget import query_budget
+from vesynta_backend.database import read_only_database
+
+def _requested_fields(request):
+    """
+    Parse ?fields=id,first_name into a list of API fields
+    Returns (fields, error_response); fields is None when not requested
+    """
+    raw_fields = request.GET.get('fields')
+    if not raw_fields:
+        return None, None
+    fields = [field.strip() for field in raw_fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in Patient.API_FIELDS]
+    if unknown or not fields:
+        return None, Response(
+            {"error": f"Unknown fields: {', '.join(unknown) or raw_fields}",
+             "allowed_fields": list(Patient.API_FIELDS)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return list(dict.fromkeys(fields)), None
 
 @api_view(['GET', 'POST'])
+@query_budget(2)
 def patient_list(request):
     """
     GET /patients - List all patients with pagination
+                    (optional ?fields=id,first_name,... for a sparse fieldset)
     POST /patients - Create a new patient in both local DB and third-party API
     """
     if request.method == 'GET':
@@ -29,8 +61,13 @@ def patient_list(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        fields, error_response = _requested_fields(request)
+        if error_response:
+            return error_response
+        
         # Always pass page to the service (even if it's 1)
-        data, status_code = api_client.get_combined_patients(page=page)
+        with read_only_database():
+            data, status_code = api_client.get_combined_patients(page=page, fields=fields)
         return Response(data, status=status_code)
     
     elif request.method == 'POST':
@@ -50,14 +87,35 @@ def patient_list(request):
         return Response(data, status=status_code)
     
 @api_view(['GET'])
+@query_budget(1)
 def patient_detail(request, patient_id):
-    """GET /patients/{id} - Get patient details from local DB or third-party API"""
-    data, status_code = api_client.get_patient(patient_id)
+    """
+    GET /patients/{id} - Get patient details from local DB or third-party API
+    Optional ?fields=id,first_name,... to return only those keys
+    """
+    fields, error_response = _requested_fields(request)
+    if error_response:
+        return error_response
+    
+    with read_only_database():
+        data, status_code = api_client.get_patient(patient_id, fields=fields)
     return Response(data, status=status_code)
 
+def _wants_async(request):
+    return request.GET.get('async', '').lower() in ('1', 'true', 'yes')
+
+def _process_query_budget(request):
+    """Queueing a job is one INSERT; a synchronous call runs no SQL"""
+    return 1 if _wants_async(request) else 0
+
 @api_view(['POST'])
+@query_budget(_process_query_budget)
 def process_patient(request, patient_id):
-    """POST /patients/{id}/process - Process patient data"""
+    """
+    POST /patients/{id}/process - Process patient data
+    With ?async=1 the call is queued instead and 202 returns the job to poll
+    at GET /jobs/{id}
+    """
     serializer = ProcessPatientSerializer(data=request.data)
     
     if not serializer.is_valid():
@@ -66,16 +124,34 @@ def process_patient(request, patient_id):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    if _wants_async(request):
+        data, status_code = enqueue_process_job(patient_id, serializer.validated_data)
+        headers = {}
+        if status_code == 202:
+            data['status_url'] = request.build_absolute_uri(reverse('job-detail', args=[data['id']]))
+            headers['Location'] = data['status_url']
+        return Response(data, status=status_code, headers=headers)
+    
     # Process the patient with validated data
     data, status_code = api_client.process_patient(patient_id, serializer.validated_data)
     return Response(data, status=status_code)
 
 @api_view(['GET'])
+@query_budget(1)
+def job_detail(request, job_id):
+    """GET /jobs/{id} - Status and result of a queued process job"""
+    data, status_code = get_job(job_id)
+    return Response(data, status=status_code)
+
+@api_view(['GET'])
+@query_budget(1)
 def local_patients_stats(request):
     """GET /patients/stats - Get statistics about patients"""
     try:
-        # Get combined patients data to calculate accurate stats
-        data, status_code = api_client.get_combined_patients()
+        # Get combined patients data to calculate accurate stats - only
+        # the source of each patient is needed
+        with read_only_database():
+            data, status_code = api_client.get_combined_patients(fields=['source'])
         
         if status_code != 200:
             return Response({"error": "Failed to load patient data"}, status=status_code)
@@ -102,7 +178,29 @@ def local_patients_stats(request):
     except Exception as e:
         return Response({"error": f"Failed to get stats: {str(e)}"}, status=500)
     
+@api_view(['GET'])
+@query_budget(2)
+def duplicate_patients(request):
+    """
+    GET /patients/duplicates - Find likely duplicate patients
+    Optional ?limit= (max blocks, default 100) and ?after= (cursor from next_after)
+    """
+    try:
+        limit = int(request.GET.get('limit', '100'))
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return Response(
+            {"error": "Limit must be a positive integer"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    with read_only_database():
+        data, status_code = api_client.find_duplicates(limit=min(limit, 1000), after=request.GET.get('after'))
+    return Response(data, status=status_code)
+
 @api_view(['DELETE'])
+@query_budget(2)
 def delete_patient(request, patient_id):
     """
     DELETE /patients/{id} - Delete a local patient
@@ -110,30 +208,143 @@ def delete_patient(request, patient_id):
     data, status_code = api_client.delete_patient(patient_id)
     return Response(data, status=status_code)
 
+COPY_REQUIRED_FIELDS = ['first_name', 'last_name', 'sex', 'ethnic_background']
+
+# Rows per bulk INSERT on SQLite, as batched by Django (999 variables / 10 columns)
+COPY_ROWS_PER_INSERT = 99
+
+
+def _missing_copy_field(patient_data):
+    """Return the first required field missing from a copy payload, if any"""
+    for field in COPY_REQUIRED_FIELDS:
+        if field not in patient_data:
+            return field
+    return None
+
+
+def _ensure_third_party_id(patient_data):
+    """Generate a stable external ID if not provided"""
+    if not patient_data.get('third_party_id'):
+        patient_info = f"{patient_data['first_name']}{patient_data['last_name']}{patient_data.get('dob', '')}"
+        patient_data['third_party_id'] = f"ext_{hashlib.md5(patient_info.encode()).hexdigest()[:12]}"
+    return patient_data
+
+
+def _copy_query_budget(request):
+    """
+    The BEGIN of bulk_create's transaction plus one IN lookup and one
+    INSERT per batch (SQLite caps variables per statement)
+    """
+    items = len(request.data) if isinstance(request.data, list) else 1
+    return 1 + math.ceil(items / COPY_LOOKUP_BATCH_SIZE) + math.ceil(items / COPY_ROWS_PER_INSERT)
+
+
 @api_view(['POST'])  # Make sure this only allows POST
+@query_budget(_copy_query_budget)
 def copy_external_patient(request):
     """
     POST /patients/copy - Create a local copy of an external patient
-    Expects the full patient data in the request body
+    Expects the full patient data in the request body, or a list of
+    patients to copy them in bulk with a per-item status
     """
     # Get the patient data from request body
     patient_data = request.data
     
-    # Validate required fields
-    required_fields = ['first_name', 'last_name', 'sex', 'ethnic_background']
-    for field in required_fields:
-        if field not in patient_data:
-            return Response(
-                {"error": f"Missing required field: {field}"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+    if isinstance(patient_data, list):
+        return _copy_external_patients(patient_data)
     
-    # Generate a stable external ID if not provided
-    if not patient_data.get('third_party_id'):
-        import hashlib
-        patient_info = f"{patient_data['first_name']}{patient_data['last_name']}{patient_data.get('dob', '')}"
-        patient_data['third_party_id'] = f"ext_{hashlib.md5(patient_info.encode()).hexdigest()[:12]}"
+    # Validate required fields
+    missing_field = _missing_copy_field(patient_data)
+    if missing_field:
+        return Response(
+            {"error": f"Missing required field: {missing_field}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
     # Call the service to create local copy
-    data, status_code = api_client.create_local_patient_copy(patient_data)
+    data, status_code = api_client.create_local_patient_copy(_ensure_third_party_id(patient_data))
     return Response(data, status=status_code)
+
+
+def _copy_external_patients(patients_data):
+    """Validate a bulk copy payload and hand the valid items to the service"""
+    if not patients_data:
+        return Response(
+            {"error": "Expected a non-empty list of patients"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    invalid_results = []
+    valid_items = []
+    for index, patient_data in enumerate(patients_data):
+        if not isinstance(patient_data, dict):
+            invalid_results.append({"index": index, "status": "invalid", "error": "Expected a patient object"})
+            continue
+        missing_field = _missing_copy_field(patient_data)
+        if missing_field:
+            invalid_results.append({
+                "index": index,
+                "status": "invalid",
+                "error": f"Missing required field: {missing_field}"
+            })
+            continue
+        valid_items.append((index, _ensure_third_party_id(patient_data)))
+    
+    data, status_code = api_client.create_local_patient_copies([item for _, item in valid_items])
+    if 'error' in data:
+        return Response(data, status=status_code)
+    
+    # Map service results back to positions in the original request
+    for result in data['results']:
+        result['index'] = valid_items[result['index']][0]
+    data['results'] = sorted(data['results'] + invalid_results, key=lambda r: r['index'])
+    data['skipped'] += len(invalid_results)
+    return Response(data, status=status_code)
+
+
+def metrics(request):
+    """GET /metrics - Prometheus text-format metrics for this process"""
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+async def patient_events(request):
+    """
+    GET /events - Server-sent events for patient changes and process results
+    Event types: patient.created, patient.copied, patient.deleted,
+    process.completed and resync (refetch everything). A reconnecting client
+    only gets a resync when its Last-Event-ID shows it missed events. Needs
+    the ASGI app; under WSGI it answers 204 so EventSource stops reconnecting.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    
+    subscription = broker.subscribe()
+    if subscription is None:
+        return HttpResponse(status=503)
+    
+    # Read after subscribing, so nothing published in between is missed
+    last_id = broker.last_id
+    missed_events = request.headers.get('Last-Event-ID', str(last_id)) != str(last_id)
+    
+    async def stream():
+        deadline = time.monotonic() + settings.EVENT_STREAM_MAX_AGE
+        try:
+            # The id gives the client a Last-Event-ID even if no event arrives
+            yield f'retry: 3000\nid: {last_id}\n\n'.encode()
+            if missed_events:
+                yield format_sse({'id': None, 'type': RESYNC, 'data': {}})
+            while time.monotonic() < deadline:
+                events = await subscription.get(timeout=settings.EVENT_STREAM_HEARTBEAT)
+                if not events:
+                    yield b': keep-alive\n\n'
+                for event in events:
+                    yield format_sse(event)
+        finally:
+            subscription.close()
+    
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
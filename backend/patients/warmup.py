@@ -0,0 +1,109 @@
+"""
+Warm start for server workers.
+
+Django loads the URLconf - and with it DRF, requests and dateutil via
+views/services - on the first request, and that request also pays for the
+upstream TLS handshake and an uncached external fetch. warm_start() moves
+that work onto a background thread at boot: it loads the URLconf, opens
+the pooled upstream connection by fetching page 1 of the external list
+into the cache, and touches the patients table so SQLite's pages are hot.
+
+It is called from wsgi.py/asgi.py, which every worker imports after
+forking (and which runserver imports too). Management commands never
+import them, so migrations and the like never call out to the upstream.
+With `gunicorn --preload` the app is imported in the master before the
+fork, and a warm-up thread there could be holding locks or an upstream
+socket when the workers fork. The master skips it when started with
+--preload (set WARM_START=False when preload_app is set in a config
+file instead), and each worker should call warm_start(force=True) from a
+post_fork hook. Forked children start with no warm-up of their own.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger('patients.warmup')
+
+_thread = None
+_lock = threading.Lock()
+# Set in forked children, which may warm even when the master was preloaded
+_forked = False
+# Step name -> seconds taken, filled in by the last warm-up
+timings = {}
+
+
+def _run():
+    start = time.perf_counter()
+
+    step_start = time.perf_counter()
+    from django.urls import get_resolver
+    get_resolver().url_patterns  # imports views -> services, DRF, requests, dateutil
+    timings['imports'] = time.perf_counter() - step_start
+
+    from django.db import connection
+    from .models import Patient
+    from .services import api_client
+
+    step_start = time.perf_counter()
+    try:
+        _, status_code = api_client.get_external_page(1)
+        timings['external_page'] = time.perf_counter() - step_start
+        if status_code != 200:
+            logger.warning("Warm start: external page 1 returned %s", status_code)
+    except Exception:
+        logger.exception("Warm start: priming the external list failed")
+
+    step_start = time.perf_counter()
+    try:
+        Patient.objects.count()
+        timings['database'] = time.perf_counter() - step_start
+    except Exception:
+        logger.exception("Warm start: touching the patients table failed")
+    finally:
+        # This connection belongs to the warm-up thread; don't leak it
+        connection.close()
+
+    timings['total'] = time.perf_counter() - start
+    logger.info("Warm start finished in %.0fms", timings['total'] * 1000)
+
+
+def _preloading_app():
+    """True in a gunicorn master started with --preload, which forks after importing the app"""
+    args = sys.argv[1:] + os.environ.get('GUNICORN_CMD_ARGS', '').split()
+    return not _forked and 'gunicorn' in (sys.argv[0] or '') and '--preload' in args
+
+
+def warm_start(force=False):
+    """Start warming this process in the background; returns the thread (or None)"""
+    global _thread
+    if not force and (not settings.WARM_START or _preloading_app()):
+        return None
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name='patients-warm-start', daemon=True)
+            _thread.start()
+    return _thread
+
+
+def wait_for_warm_start(timeout=None):
+    """Block until a started warm-up has finished; True if none is still running"""
+    if _thread is not None:
+        _thread.join(timeout)
+    return _thread is None or not _thread.is_alive()
+
+
+def _reset_after_fork():
+    """The parent's warm-up thread doesn't exist in a forked child"""
+    global _thread, _lock, _forked
+    _thread = None
+    _lock = threading.Lock()
+    _forked = True
+    timings.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vesynta_backend.settings')
 
 application = get_asgi_application()
+
+from patients.warmup import warm_start  # noqa: E402
+
+warm_start()
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 from dotenv import load_dotenv
 
 
@@ -49,6 +50,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'patients.middleware.TimingMiddleware',
+    'patients.middleware.QueryLogMiddleware',
+    'patients.middleware.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -86,10 +90,66 @@ WSGI_APPLICATION = 'vesynta_backend.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        # Keep connections open between requests instead of reconnecting each time
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# SQLite performance profile, applied to every new connection
+# (see vesynta_backend/database.py). Set SQLITE_PERFORMANCE_PROFILE=False
+# to fall back to SQLite's defaults.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'temp_store': 'MEMORY',
+    'cache_size': -20000,  # ~20MB page cache per connection
+} if os.getenv('SQLITE_PERFORMANCE_PROFILE', 'True') == 'True' else {}
+
+# Optional second connection for read-only list/detail/stats queries
+if os.getenv('DATABASE_READ_ROUTING', 'False') == 'True':
+    DATABASES['readonly'] = {
+        **DATABASES['default'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['vesynta_backend.database.ReadOnlyRouter']
+
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
+# Query instrumentation (see patients/query_budget.py): statements slower than
+# this are logged, and views over their @query_budget fail under tests
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 100))
+QUERY_BUDGET_RAISE = TESTING or os.getenv('QUERY_BUDGET_RAISE', 'False') == 'True'
+
+# Server-sent event stream (GET /api/events, see patients/events.py)
+EVENT_STREAM_BUFFER = int(os.getenv('EVENT_STREAM_BUFFER', 100))  # events buffered per client
+EVENT_STREAM_MAX_CLIENTS = int(os.getenv('EVENT_STREAM_MAX_CLIENTS', 1000))
+EVENT_STREAM_HEARTBEAT = 15  # seconds between keep-alive comments
+# Streams end after this many seconds and EventSource reconnects; bounds
+# streams left behind by disconnected clients, which Django 4.2 can't detect
+EVENT_STREAM_MAX_AGE = 300
+
+# Response compression (patients.middleware.CompressionMiddleware). Brotli is
+# used when the optional `brotli` package is installed, gzip otherwise.
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'patients.queries': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
 
 CACHES = {
     'default': {
@@ -104,7 +164,7 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'patients.renderers.TimedJSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
@@ -154,11 +214,27 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 EXTERNAL_API_URL = os.getenv('EXTERNAL_API_URL', 'https://coding-patient-api.vesynta.workers.dev/api')
 CACHE_TIMEOUT = int(os.getenv('CACHE_TIMEOUT', 3600))
+# How long a page of the third-party patient list is reused (0 disables)
+EXTERNAL_LIST_CACHE_TIMEOUT = int(os.getenv('EXTERNAL_LIST_CACHE_TIMEOUT', 30))
+# Warm each server worker at boot (see patients/warmup.py)
+WARM_START = os.getenv('WARM_START', 'True') == 'True'
 RATE_LIMIT_PER_MINUTE = int(os.getenv('RATE_LIMIT_PER_MINUTE', 90))
 
+# Background process jobs (POST /api/patients/{id}/process?async=1, see patients/jobs.py)
+# Worker threads per server process; tests drive jobs by hand instead
+JOB_WORKERS = 0 if TESTING else int(os.getenv('JOB_WORKERS', 2))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_BASE_DELAY = 2  # seconds, doubled after each failed attempt
+JOB_RETRY_MAX_DELAY = 60
+JOB_POLL_INTERVAL = 1.0  # seconds an idle worker waits before checking the table again
+# Running jobs not updated for this long belonged to a worker that died; requeue them
+JOB_STALE_AFTER = 120
+
 
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",  # Next.js frontend
     "http://127.0.0.1:3000",
-]
\ No newline at end of file
+]
+# Let the browser read per-request timings from cross-origin responses
+CORS_EXPOSE_HEADERS = ['Server-Timing']
\ No newline at end of file
@@ -16,9 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path
+from patients.views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('patients.urls')),
+    path('metrics', metrics, name='metrics'),
 
 ]
@@ -2,6 +2,12 @@
 
 import { useState } from 'react';
 import { QueryClient, QueryClientProvider } from '@tanstack/react-query';
+import { usePatientEvents } from '@/hooks/usePatients';
+
+function PatientEvents() {
+  usePatientEvents();
+  return null;
+}
 
 export default function Providers({ children }: { children: React.ReactNode }) {
   const [queryClient] = useState(
@@ -19,6 +25,7 @@ export default function Providers({ children }: { children: React.ReactNode }) {
 
   return (
     <QueryClientProvider client={queryClient}>
+      <PatientEvents />
       {children}
     </QueryClientProvider>
   );
@@ -1,7 +1,8 @@
 'use client';
 
+import { useEffect, useSyncExternalStore } from 'react';
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query';
-import { patientApi } from '@/lib/api';
+import { API_BASE_URL, patientApi } from '@/lib/api';
 import { ProcessPatientData } from '@/types/patient';
 
 // Cache keys
@@ -14,22 +15,52 @@ export const patientKeys = {
   process: (id: string, data: ProcessPatientData) => [...patientKeys.detail(id), 'process', data] as const,
 };
 
+// Whether the live event stream (usePatientEvents) is connected. While it
+// is, changes arrive as events, so lists and details can stay fresh much
+// longer and don't need refetching on window focus.
+let eventStreamOpen = false;
+const eventStreamListeners = new Set<() => void>();
+const LIVE_STALE_TIME = 10 * 60 * 1000; // 10 minutes
+
+function setEventStreamOpen(open: boolean) {
+  if (open === eventStreamOpen) return;
+  eventStreamOpen = open;
+  eventStreamListeners.forEach((listener) => listener());
+}
+
+function subscribeToEventStream(listener: () => void) {
+  eventStreamListeners.add(listener);
+  return () => {
+    eventStreamListeners.delete(listener);
+  };
+}
+
+export function useEventStreamOpen() {
+  return useSyncExternalStore(subscribeToEventStream, () => eventStreamOpen, () => false);
+}
+
 // Optimized hooks
 export function usePatients(page: number = 1) {
+  const live = useEventStreamOpen();
+
   return useQuery({
     queryKey: patientKeys.list(`page-${page}`),
     queryFn: () => patientApi.getPatients(page),
-    staleTime: 30 * 1000, // 30 seconds
+    staleTime: live ? LIVE_STALE_TIME : 30 * 1000, // 30 seconds without the stream
     gcTime: 5 * 60 * 1000, // 5 minutes
+    refetchOnWindowFocus: !live,
   });
 }
 
 export function usePatient(id: string) {
+  const live = useEventStreamOpen();
+
   return useQuery({
     queryKey: patientKeys.detail(id),
     queryFn: () => patientApi.getPatient(id),
     enabled: !!id, // Only run if ID exists
-    staleTime: 5 * 60 * 1000, // 5 minutes for individual patients
+    staleTime: live ? LIVE_STALE_TIME : 5 * 60 * 1000, // 5 minutes without the stream
+    refetchOnWindowFocus: !live,
   });
 }
 
@@ -109,4 +140,41 @@ export function useCachedProcessResult(patientId: string, processData: ProcessPa
     staleTime: 10 * 60 * 1000, // 10 minutes for process results
     gcTime: 30 * 60 * 1000, // 30 minutes garbage collection
   });
-}
\ No newline at end of file
+}
+// Live updates: the backend pushes patient changes over server-sent events,
+// so cached queries are invalidated as soon as something changes instead of
+// being refetched on a timer or on focus. The stream needs the ASGI server;
+// under WSGI it answers 204, EventSource stops reconnecting and queries fall
+// back to their normal staleTime.
+export function usePatientEvents() {
+  const queryClient = useQueryClient();
+
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') return;
+
+    const source = new EventSource(`${API_BASE_URL}/events`);
+    const invalidateLists = () =>
+      queryClient.invalidateQueries({ queryKey: patientKeys.lists() });
+
+    source.onopen = () => setEventStreamOpen(true);
+    source.onerror = () => setEventStreamOpen(false);
+
+    source.addEventListener('patient.created', invalidateLists);
+    source.addEventListener('patient.copied', invalidateLists);
+    source.addEventListener('patient.deleted', (event) => {
+      const { id } = JSON.parse((event as MessageEvent).data);
+      invalidateLists();
+      queryClient.removeQueries({ queryKey: patientKeys.detail(id) });
+    });
+    // Sent when this client fell too far behind or missed events while
+    // reconnecting; refetch everything
+    source.addEventListener('resync', () =>
+      queryClient.invalidateQueries({ queryKey: patientKeys.all })
+    );
+
+    return () => {
+      source.close();
+      setEventStreamOpen(false);
+    };
+  }, [queryClient]);
+}
@@ -1,7 +1,7 @@
 import axios from 'axios';
 import { Patient, PatientCreate, ProcessPatientData, PatientListResponse } from '@/types/patient';
 
-const API_BASE_URL = process.env.NEXT_PUBLIC_API_BASE_URL || 'http://localhost:8000/api';
+export const API_BASE_URL = process.env.NEXT_PUBLIC_API_BASE_URL || 'http://localhost:8000/api';
 
 const api = axios.create({
     baseURL: API_BASE_URL,